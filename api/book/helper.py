@@ -1,13 +1,158 @@
+import base64
+import json
+
+from django.core.exceptions import FieldDoesNotExist
+from django.core.paginator import Paginator
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
 from rest_framework.pagination import PageNumberPagination
 from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
 from collections import OrderedDict
 from datetime import datetime
+
+from django.utils.functional import cached_property
+
+from apps.base.cache import count_rows
+
+
+class Keyset:
+    """
+    The ordering of a queryset as ``(field, descending)`` pairs ending with ``id``, so the
+    position after a row can be expressed as a WHERE clause instead of an OFFSET.
+    """
+
+    def __init__(self, fields):
+        self.fields = fields
+
+    @classmethod
+    def from_queryset(cls, queryset):
+        """None when the ordering can't be seeked on: random order, expressions, related or nullable fields."""
+        fields = []
+        for item in queryset.query.order_by or queryset.model._meta.ordering or ():
+            if not isinstance(item, str) or item == '?' or '__' in item:
+                return None
+            name = item.lstrip('-')
+            name = 'id' if name == 'pk' else name
+            if name not in queryset.query.annotations:
+                try:
+                    if queryset.model._meta.get_field(name).null:
+                        return None
+                except FieldDoesNotExist:
+                    return None
+            fields.append((name, item.startswith('-')))
+            if name == 'id':
+                return cls(fields)
+        return cls(fields + [('id', False)])
+
+    def order(self, queryset):
+        return queryset.order_by(*[f'-{name}' if descending else name for name, descending in self.fields])
+
+    def values(self, obj):
+        return [getattr(obj, name) for name, _ in self.fields]
+
+    def after(self, values):
+        """Rows strictly after the row with the given sort values."""
+        condition = Q()
+        for index, (name, descending) in enumerate(self.fields):
+            step = Q(**{f'{name}__lt' if descending else f'{name}__gt': values[index]})
+            for (previous, _), value in zip(self.fields[:index], values):
+                step &= Q(**{previous: value})
+            condition |= step
+        return condition
+
+    @staticmethod
+    def encode(values):
+        # str() keeps the microseconds of datetimes, which the seek compares exactly
+        return base64.urlsafe_b64encode(json.dumps(values, default=str).encode()).decode()
+
+    def decode(self, cursor):
+        try:
+            values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        except (ValueError, TypeError):
+            raise NotFound('Invalid cursor')
+        if not isinstance(values, list) or len(values) != len(self.fields) or None in values:
+            raise NotFound('Invalid cursor')
+        return values
+
+
+class CountedPaginator(Paginator):
+    """
+    Paginator whose count is cached per filter set and, above ``estimate_above`` rows, taken
+    from the planner estimate; ``approximate`` tells which one it is.
+    """
+    estimate_above = 10000
+
+    @cached_property
+    def counted(self):
+        return count_rows(self.object_list, estimate_above=self.estimate_above)
+
+    @cached_property
+    def count(self):
+        return self.counted[0]
+
+    @property
+    def approximate(self):
+        return self.counted[1]
+
+
 class LargeResultsSetPagination(PageNumberPagination):
+    """
+    Page numbers by default. ``?cursor=`` (empty for the first page) switches to keyset
+    pagination on the queryset ordering plus id: no OFFSET, so a deep page costs the same
+    as the first one.
+    Totals are cached per filter set for a short while; above the paginator's
+    ``estimate_above`` rows they are PostgreSQL planner estimates, flagged with ``count_approximate``.
+    """
     page_size = 10
     page_size_query_param = 'page_size'
     max_page_size = 1000
+    cursor_query_param = 'cursor'
+    django_paginator_class = CountedPaginator
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = None
+        if self.cursor_query_param in request.query_params:
+            keyset = Keyset.from_queryset(queryset)
+            if keyset is not None:
+                self.keyset = keyset
+                return self.paginate_keyset(queryset, request)
+        return super().paginate_queryset(queryset, request, view)
+
+    def paginate_keyset(self, queryset, request):
+        self.request = request
+        self.queryset = queryset
+        self.cursor_page_size = self.get_page_size(request) or LargeResultsSetPagination.page_size
+        cursor = request.query_params.get(self.cursor_query_param)
+        page = self.keyset.order(queryset)
+        if cursor:
+            page = page.filter(self.keyset.after(self.keyset.decode(cursor)))
+        rows = list(page[:self.cursor_page_size + 1])
+        self.next_cursor = None
+        if len(rows) > self.cursor_page_size:
+            rows = rows[:self.cursor_page_size]
+            self.next_cursor = self.keyset.encode(self.keyset.values(rows[-1]))
+        return rows
+
+    def get_keyset_response(self, data):
+        next_link = None
+        if self.next_cursor:
+            next_link = replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param,
+                                            self.next_cursor)
+        count, approximate = count_rows(self.queryset, estimate_above=self.django_paginator_class.estimate_above)
+        return Response(OrderedDict([
+            ('server_time', datetime.now()),
+            ('count', count),
+            ('count_approximate', approximate),
+            ('page_size', self.cursor_page_size),
+            ('next', next_link),
+            ('previous', None),
+            ('results', data)
+        ]))
 
     def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.get_keyset_response(data)
         if self.request.query_params.get('page_size'):
             page_size = self.request.query_params.get('page_size')
         else:
@@ -15,6 +160,7 @@ class LargeResultsSetPagination(PageNumberPagination):
         return Response(OrderedDict([
             ('server_time', datetime.now()),
             ('count', self.page.paginator.count),
+            ('count_approximate', self.page.paginator.approximate),
             ('page_count', self.page.paginator.num_pages),
             ('page', self.page.number),
             ('page_size', int(page_size)),
@@ -22,3 +168,8 @@ class LargeResultsSetPagination(PageNumberPagination):
             ('previous', self.get_previous_link()),
             ('results', data)
         ]))
+
+
+class OptionalResultsSetPagination(LargeResultsSetPagination):
+    """Unpaginated unless ``?page_size=`` or ``?cursor=`` is given, for endpoints that always returned plain lists."""
+    page_size = None
@@ -1,7 +1,7 @@
 import datetime
 import django_filters
 from django.db.models import Q
-from apps.product.models import Brand, Category, Product, PRODUCT_TYPE, Size
+from apps.product.models import Brand, Category, Product, PRODUCT_TYPE, ProductInstallment, Size
 from django.db import models
 
 class SizeFilter(django_filters.FilterSet):
@@ -59,4 +59,16 @@ class ProductFilter(django_filters.FilterSet):
                 type(queryset).__name__,
             )
         return queryset
-    
\ No newline at end of file
+    
+
+
+class NumberInFilter(django_filters.BaseInFilter, django_filters.NumberFilter):
+    pass
+
+
+class ProductInstallmentFilter(django_filters.FilterSet):
+    product = NumberInFilter(field_name='product_id', lookup_expr='in')
+
+    class Meta:
+        model = ProductInstallment
+        fields = ['product']
@@ -1,8 +1,17 @@
-from django.db.models import Avg
+from django.db import models
 from rest_framework import serializers
 from apps.product.models import Author, Category, Brand, Color, Currency, BannerDiscount, Advertisement, Banner, Size, \
-    ProductImage, Product, Rate, AdditionalInfo
+    ProductImage, Product, Rate, AdditionalInfo, ProductInstallment, get_currency
 from apps.base.models import Variant
+from apps.product.pricing import price_products
+
+
+class PricedListSerializer(serializers.ListSerializer):
+    """Prices the whole page with PricingEngine before the child serializer reads the price properties."""
+
+    def to_representation(self, data):
+        iterable = data.all() if isinstance(data, models.Manager) else data
+        return super().to_representation(price_products(iterable))
 
 
 class VariantSerializer(serializers.ModelSerializer):
@@ -29,7 +38,8 @@ class CategoryListSerializer(serializers.ModelSerializer):
 
     @staticmethod
     def get_children(obj):
-        return CategoryCreateSerializer(obj.children.all(), many=True).data
+        # get_children() reads the children cached by get_cached_trees() when there are any
+        return CategoryCreateSerializer(obj.get_children(), many=True).data
 
 
 class BrandSerializer(serializers.ModelSerializer):
@@ -128,9 +138,10 @@ class ProductListSerializer(serializers.ModelSerializer):
         model = Product
         fields = ['id', 'title_uz', 'title_ru', 'author', 'product_type', 'brand_uz', 'brand_ru', 'status',
                   'category', 'price_uzs', 'discount_uzs', 'is_active', 'language', 'yozuv']
+        list_serializer_class = PricedListSerializer
 
     def validate(self, attrs):
-        currency = Currency.objects.last()
+        currency = get_currency()
         if currency is None:
             return serializers.ValidationError('Currency not found')
         return attrs
@@ -177,7 +188,7 @@ class ProductImagesSerializer(serializers.ModelSerializer):
     @staticmethod
     def get_price_uzs(obj):
         if obj.price:
-            return obj.price * Currency.objects.last().amount
+            return obj.price * get_currency().amount
         return 0
 
 
@@ -200,6 +211,12 @@ class ProductDetailSerializer(serializers.ModelSerializer):
             'price_uzs', 'discount_uzs', 'view', 'mid_rate', 'mid_rate_percent', 'availability', 'description_uz', 'description_ru',
             'product_images', 'additional_info', 'is_active', 'yozuv', 'advertisement', 'banner_discount', 'brand'
         ]
+        list_serializer_class = PricedListSerializer
+
+    def to_representation(self, instance):
+        if getattr(instance, '_prices', None) is None:
+            price_products([instance])
+        return super().to_representation(instance)
 
     def get_category(self, obj):
         return CategoryListSerializer(obj.category.all(), many=True).data
@@ -210,22 +227,11 @@ class ProductDetailSerializer(serializers.ModelSerializer):
 
     @staticmethod
     def get_mid_rate(obj):
-        result = Rate.objects.filter(
-            product=obj.id).aggregate(avarage=Avg("rate"))
-        if result['avarage']:
-            return round(result['avarage'], 1)
-        else:
-            return 0.0
+        return obj.mid_rate
 
     @staticmethod
     def get_mid_rate_percent(obj):
-        result = Rate.objects.filter(
-            product=obj.id).aggregate(avarage=Avg("rate"))
-        if result['avarage']:
-            percent = result['avarage'] * 100 / 5
-            return percent
-        else:
-            return 0.0
+        return obj.mid_rate_percent
 
     @staticmethod
     def get_product_images(obj):
@@ -233,17 +239,11 @@ class ProductDetailSerializer(serializers.ModelSerializer):
 
     @staticmethod
     def get_price_uzs(obj):
-        if obj.product_images.first().price:
-            return obj.product_images.first().price * Currency.objects.last().amount
-        return 0
+        return obj.price_uzs
 
     @staticmethod
     def get_discount_uzs(obj):
-        if obj.percentage:
-            discount_sell = obj.product_images.first().price - (
-                    obj.product_images.first().price * (obj.percentage / 100))
-            return discount_sell * Currency.objects.last().amount
-        return 0
+        return obj.discounted_uzs
 
     @staticmethod
     def get_additional_info(obj):
@@ -251,6 +251,15 @@ class ProductDetailSerializer(serializers.ModelSerializer):
 
 
 
+class ProductInstallmentSerializer(serializers.ModelSerializer):
+    duration = serializers.IntegerField(source='variant.duration', read_only=True)
+    percent = serializers.IntegerField(source='variant.percent', read_only=True)
+
+    class Meta:
+        model = ProductInstallment
+        fields = ['product', 'variant', 'duration', 'percent', 'total', 'monthly']
+
+
 class ProductImageSZ(serializers.Serializer):
     id = serializers.IntegerField()
     image = serializers.FileField()
@@ -3,7 +3,7 @@ from rest_framework.routers import DefaultRouter
 
 from .views import CategoryViewSet, BrandViewSet, ColorViewSet, CurrencyViewSet, BannerDiscountViewSet, \
     AdvertisementViewSet, BannerViewSet, SizeViewSet, ProductImageViewSet, ProductViewSet, AdditionalInfoViewSet, \
-    RateViewSet, VariantViewSet, AuthorModelViewSet
+    RateViewSet, VariantViewSet, AuthorModelViewSet, ProductInstallmentViewSet, ProductDiscountViewSet
 
 router = DefaultRouter()
 
@@ -17,6 +17,8 @@ router.register('advertisement', AdvertisementViewSet, basename='advertisement')
 router.register('banner', BannerViewSet, basename='banner')
 router.register('size', SizeViewSet, basename='size')
 router.register('product/image', ProductImageViewSet, basename='product-image')
+router.register('product/installments', ProductInstallmentViewSet, basename='product-installments')
+router.register('product/discounts', ProductDiscountViewSet, basename='product-discounts')
 router.register('product', ProductViewSet, basename='product')
 router.register('additional-info', AdditionalInfoViewSet, basename='additional-info')
 router.register('rate', RateViewSet, basename='rate')
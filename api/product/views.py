@@ -1,9 +1,10 @@
+from django.db import transaction
 from django.db.models import Q, Min,F,ExpressionWrapper, fields
 from django.shortcuts import get_object_or_404
 from rest_framework.parsers import MultiPartParser, FormParser
-from api.book.helper import LargeResultsSetPagination
+from api.book.helper import LargeResultsSetPagination, OptionalResultsSetPagination
 from .serializers import AuthorSerializer, ProductImageSZ
-from .filter import BrandFilter, CategoryFilter, ProductFilter, SizeFilter
+from .filter import BrandFilter, CategoryFilter, ProductFilter, ProductInstallmentFilter, SizeFilter
 from api.book.serializers import BookImageSerializer
 from django.db.models import Value, FloatField
 from django.db.models.expressions import RawSQL
@@ -12,9 +13,15 @@ from .serializers import CategoryListSerializer, CategoryCreateSerializer, Brand
     CurrencySerializer, BannerDiscountSerializer, AdvertisementSerializer, BannerSerializer, SizeSerializer, \
     ProductImageCreateSerializer, ProductImageListSerializer, ProductCreateSerializer, ProductDetailSerializer, \
     ProductListSerializer, AdditionalInfoListSerializer, AdditionalInfoCreateSerializer, RateCreateSerializer, \
-    RateListSerializer, VariantSerializer
+    RateListSerializer, VariantSerializer, ProductInstallmentSerializer
 from apps.product.models import Author, Category, Brand, Color, Currency, BannerDiscount, Advertisement, Banner, Size, \
-    ProductImage, Product, AdditionalInfo, Rate
+    ProductImage, Product, AdditionalInfo, Rate, ProductInstallment
+from apps.product.api.filters import FullTextSearchFilter, TRUE_VALUES
+from apps.product.categories import get_category_tree
+from apps.product.gallery import Gallery
+from apps.product.pricing import dirty_products
+from apps.product.search import search_products
+from apps.product.suggest import suggest
 from apps.base.models import Variant
 from api.account.permissions import IsSuperUser
 from rest_framework import viewsets, mixins, status, filters, permissions
@@ -50,6 +57,9 @@ class CategoryViewSet(mixins.ListModelMixin, mixins.RetrieveModelMixin, mixins.C
         return Response(serializer.data, status=status.HTTP_200_OK)
 
     def list(self, request, *args, **kwargs):
+        if not request.query_params:
+            roots = [category for category in get_category_tree().roots if category.is_active]
+            return Response(self.get_serializer(sorted(roots, key=lambda category: -category.id), many=True).data)
         queryset = self.filter_queryset(
             self.get_queryset().filter(parent__isnull=True))
 
@@ -234,6 +244,7 @@ class ProductImageViewSet(mixins.ListModelMixin, mixins.RetrieveModelMixin, mixi
     serializer_class = ProductImageListSerializer
     ordering_fields = ['created_at']
     parser_classes = [MultiPartParser, FormParser]
+    pagination_class = OptionalResultsSetPagination
 
     def get_queryset(self):
         return ProductImage.objects.all().order_by('-id')
@@ -267,13 +278,12 @@ class ProductImageViewSet(mixins.ListModelMixin, mixins.RetrieveModelMixin, mixi
 class ProductViewSet(mixins.ListModelMixin, mixins.RetrieveModelMixin, mixins.CreateModelMixin,
                      mixins.UpdateModelMixin, mixins.DestroyModelMixin, viewsets.GenericViewSet):
     serializer_class = ProductListSerializer
-    queryset = Product.objects.all().order_by('-id')
+    queryset = Product.objects.select_related('brand', 'author').prefetch_related('category').order_by('-id')
     ordering_fields = ['created_at']
     filterset_class = ProductFilter
     filter_backends = [DjangoFilterBackend,
-                       filters.SearchFilter, filters.OrderingFilter]
+                       FullTextSearchFilter, filters.OrderingFilter]
 
-    search_fields = ['title', 'description']
     pagination_class = LargeResultsSetPagination
 
     def get_queryset(self):
@@ -292,10 +302,7 @@ class ProductViewSet(mixins.ListModelMixin, mixins.RetrieveModelMixin, mixins.Cr
             q_objects &= Q(uzs_price__gte=int(price_min))
         if price_max is not None:
             q_objects &= Q(uzs_price__lte=int(price_max))
-        print(qs)
-        print(q_objects)
         qs = qs.filter(q_objects)
-        print(qs)
         if size:
             qs = qs.filter(size=size)
         if banner_discount:
@@ -323,6 +330,7 @@ class ProductViewSet(mixins.ListModelMixin, mixins.RetrieveModelMixin, mixins.Cr
         return Response(sz.data)
 
 
+    @transaction.atomic
     def create(self, request, *args, **kwargs):
         data = request.data
         sz_ = ProductCreateSerializer(data=data)
@@ -349,6 +357,27 @@ class ProductViewSet(mixins.ListModelMixin, mixins.RetrieveModelMixin, mixins.Cr
                 images[file].append(sz.data)
         return Response({'data': sz_.data, 'images': images, 'errors': errors}, status=status.HTTP_201_CREATED)
 
+    @action(methods=['get'], detail=False)
+    def search(self, request, *args, **kwargs):
+        """
+        Ranked full-text search over active products: ``?q=samsung televizor``, best match first.
+        ``&fuzzy=1`` tolerates typos.
+        """
+        fuzzy = request.GET.get('fuzzy', '').lower() in TRUE_VALUES
+        queryset = search_products(self.queryset.filter(is_active=True), request.GET.get('q'), fuzzy=fuzzy)
+        page = self.paginate_queryset(queryset)
+        sz = ProductListSerializer(page, many=True)
+        return self.get_paginated_response(sz.data)
+
+    @action(methods=['get'], detail=False, authentication_classes=[], permission_classes=[permissions.AllowAny])
+    def suggest(self, request, *args, **kwargs):
+        """Search-as-you-type: ``?q=sam&limit=5``, served from the in-process prefix index without touching the database."""
+        try:
+            limit = min(max(int(request.GET.get('limit', 5)), 1), 20)
+        except ValueError:
+            limit = 5
+        return Response(suggest(request.GET.get('q', ''), limit))
+
     @action(methods=['delete'], detail=True)
     def remove_image(self, request,pk = None):
         product = self.get_object()
@@ -376,32 +405,14 @@ class ProductViewSet(mixins.ListModelMixin, mixins.RetrieveModelMixin, mixins.Cr
         else:
             images = product.product_images.filter(color = color)
             images.update(price=price)
+        dirty_products.add(product.id)
 
         return Response({'data': 'updated'}, status=status.HTTP_200_OK)
     
     @action(methods=['get'],detail=True)
     def images(self, request, pk=None):
         product = self.get_object()
-        images = product.product_images.all()
-        product_images = []
-        if images and product.product_type !='book':
-            colors = set(images.values_list('color',flat=True))
-            for i in colors:
-
-                images_ = images.filter(color = i)
-                price = images_.first().price
-                color = images_.first().color
-                sz = ProductImageSZ(images_,many=True)
-              
-                product_images.append({'color_id':color.id,'color_title':color.title,'price':price,'images':sz.data})
-        elif images:
-            wrappers = ('qattiq','yumshoq')
-            for i in wrappers:
-                images_ = images.filter(wrapper = i)
-                if images_:
-                    price = images_.first().price
-                    sz = ProductImageSZ(images_,many=True)
-                    product_images.append({'wrapper':i,'price':price,'images':sz.data})
+        product_images = Gallery(product).as_list(lambda images: ProductImageSZ(images, many=True).data)
         return Response({'product_type':product.product_type,'all_images':product_images})
 
     def get_permissions(self):
@@ -414,6 +425,43 @@ class ProductViewSet(mixins.ListModelMixin, mixins.RetrieveModelMixin, mixins.Cr
         return [permission() for permission in permission_classes]
 
 
+class ProductInstallmentViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
+    serializer_class = ProductInstallmentSerializer
+    pagination_class = None
+    permission_classes = [permissions.AllowAny]
+    filter_backends = [DjangoFilterBackend]
+    filterset_class = ProductInstallmentFilter
+
+    def get_queryset(self):
+        # ?product=1,2,3 is required; anything but numbers is a 400 from the filterset
+        qs = ProductInstallment.objects.select_related('variant').order_by('product_id', 'variant__duration')
+        if self.request.GET.get('product'):
+            return qs
+        return qs.none()
+
+
+class ProductDiscountViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
+    """The discount feed: ``?product_type=book&limit=10&offset=0``, without a COUNT over the catalog."""
+    serializer_class = ProductListSerializer
+    pagination_class = None
+    permission_classes = [permissions.AllowAny]
+    default_limit = 10
+    max_limit = 50
+
+    def get_queryset(self):
+        qs = Product.objects.filter(is_active=True).select_related('brand', 'author') \
+            .prefetch_related('category').order_by('shuffle_key', 'id')
+        product_type = self.request.GET.get('product_type')
+        if product_type:
+            qs = qs.filter(product_type=product_type)
+        try:
+            limit = min(int(self.request.GET.get('limit', self.default_limit)), self.max_limit)
+            offset = max(int(self.request.GET.get('offset', 0)), 0)
+        except ValueError:
+            limit, offset = self.default_limit, 0
+        return Product.discounted(qs)[offset:offset + max(limit, 0)]
+
+
 class AdditionalInfoViewSet(mixins.ListModelMixin, mixins.RetrieveModelMixin, mixins.CreateModelMixin,
                             mixins.UpdateModelMixin, mixins.DestroyModelMixin, viewsets.GenericViewSet):
     serializer_class = AdditionalInfoListSerializer
@@ -0,0 +1,108 @@
+import hashlib
+import json
+import threading
+import time
+
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet
+from django.db import connections
+
+VERSION_KEY = 'version:%s'
+COUNT_KEY = 'count:%s'
+COUNT_TIMEOUT = 60
+
+_registry = {}
+
+
+def get_version(name):
+    """Shared version stamp of ``name``; recreated if the cache has dropped it."""
+    key = VERSION_KEY % name
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time_ns(), None)
+        version = cache.get(key)
+    return version
+
+
+def bump_version(name):
+    """Invalidate everything cached under ``name`` in every worker."""
+    cache.set(VERSION_KEY % name, time.time_ns(), None)
+    for process_cache in _registry.get(name, ()):
+        process_cache.clear()
+
+
+class ProcessCache:
+    """
+    Keeps the result of ``loader`` in process memory.
+    The shared version stamp is re-read at most every ``check_interval`` seconds,
+    so a write in one gunicorn worker reaches the others within that interval.
+    """
+
+    def __init__(self, name, loader, check_interval=1):
+        self.name = name
+        self.loader = loader
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._value = None
+        self._version = None
+        self._checked_at = 0
+        _registry.setdefault(name, []).append(self)
+
+    def get(self):
+        now = time.monotonic()
+        if now - self._checked_at >= self.check_interval:
+            version = get_version(self.name)
+            if version != self._version or version is None:
+                self.clear()
+                self._version = version
+            self._checked_at = now
+        value = self._value
+        if value is None:
+            with self._lock:
+                if self._value is None:
+                    self._value = self.loader()
+                value = self._value
+        return value
+
+    def clear(self):
+        self._value = None
+        self._checked_at = 0
+
+    def invalidate(self):
+        bump_version(self.name)
+
+
+def estimate_count(queryset):
+    """The planner's row estimate for ``queryset`` on PostgreSQL, None elsewhere."""
+    if connections[queryset.db].vendor != 'postgresql':
+        return None
+    plan = json.loads(queryset.order_by().explain(format='json'))
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+def count_rows(queryset, estimate_above=None, timeout=COUNT_TIMEOUT):
+    """
+    ``(count, approximate)`` of ``queryset``, cached per filter set (its SQL without the
+    ordering) for ``timeout`` seconds. With ``estimate_above``, a planner estimate above that
+    many rows is returned as approximate instead of running the exact COUNT.
+    """
+    queryset = queryset.order_by()
+    try:
+        sql, params = queryset.query.sql_with_params()
+    except EmptyResultSet:
+        return 0, False
+    key = COUNT_KEY % hashlib.md5(repr((queryset.db, sql, params, estimate_above)).encode()).hexdigest()
+    result = cache.get(key)
+    if result is None:
+        estimate = estimate_count(queryset) if estimate_above is not None else None
+        if estimate is not None and estimate > estimate_above:
+            result = (estimate, True)
+        else:
+            result = (queryset.count(), False)
+        cache.set(key, result, timeout)
+    return tuple(result)
+
+
+def cached_count(queryset, timeout=COUNT_TIMEOUT):
+    """The exact ``queryset.count()``, cached like count_rows."""
+    return count_rows(queryset, timeout=timeout)[0]
@@ -0,0 +1,43 @@
+import threading
+
+from django.db import connections
+
+
+class BackgroundJob:
+    """
+    Runs ``job`` in a daemon thread of this worker, so the request that calls start() returns
+    at once. A start() while the job is running makes it run once more when it finishes, so
+    no request is missed and at most one thread runs per worker. The thread closes its own
+    database connections when it exits. Work still queued when the worker exits is lost, so
+    ``job`` should pick its work up from shared state (e.g. cache flags) a later run can see.
+    """
+
+    def __init__(self, job, name):
+        self.job = job
+        self.name = name
+        self._lock = threading.Lock()
+        self._thread = None
+        self._wanted = False
+
+    def start(self):
+        with self._lock:
+            self._wanted = True
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        try:
+            while True:
+                with self._lock:
+                    if not self._wanted:
+                        self._thread = None
+                        return
+                    self._wanted = False
+                self.job()
+        except BaseException:
+            with self._lock:
+                self._thread = None
+            raise
+        finally:
+            connections.close_all()
@@ -0,0 +1,48 @@
+# Generated by Django 4.2.3 on 2026-10-18 14:16
+# Catch-up migration: the models had drifted from the committed migrations, so a database
+# that was built from the models (or from migrations never committed) already has these
+# columns and tables. On such a database record it without running it:
+#     manage.py migrate base 0002 --fake
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('base', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='variant',
+            name='is_integration',
+            field=models.BooleanField(blank=True, default=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='variant',
+            name='name',
+            field=models.CharField(blank=True, max_length=50, null=True),
+        ),
+        migrations.AddField(
+            model_name='variant',
+            name='product_type',
+            field=models.CharField(blank=True, choices=[('book', 'Book'), ('clothing', 'Clothing'), ('product', 'Product')], max_length=50, null=True),
+        ),
+        migrations.CreateModel(
+            name='Profile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('role', models.CharField(choices=[('admin', 'Admin'), ('content_maker', 'Content_Maker'), ('staff', 'Staff')], default='staff', max_length=15)),
+                ('user', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+    ]
@@ -1,5 +1,9 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import User
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from apps.base.cache import ProcessCache
 
 PRODUCT_TYPE = (
     ('book', 'Book'),
@@ -40,3 +44,42 @@ class Variant(BaseAbstractDate):
 
     def __str__(self):
         return str(self.duration)
+
+
+variants_cache = ProcessCache('variants', lambda: list(Variant.objects.all().order_by('duration', 'id')))
+
+
+def get_variants(product_type=None):
+    """Variants ordered by duration, optionally limited to one product type."""
+    variants = variants_cache.get()
+    if product_type is None:
+        return list(variants)
+    return [variant for variant in variants if variant.product_type == product_type]
+
+
+def get_variant(variant_id):
+    for variant in variants_cache.get():
+        if variant.id == variant_id:
+            return variant
+    return None
+
+
+def get_longest_variant(product_type=None):
+    variants = get_variants(product_type)
+    return variants[-1] if variants else None
+
+
+def get_cheapest_variant(product_type):
+    variants = get_variants(product_type)
+    return min(variants, key=lambda variant: (variant.percent, variant.id)) if variants else None
+
+
+def get_last_variant():
+    variants = variants_cache.get()
+    return max(variants, key=lambda variant: variant.id) if variants else None
+
+
+@receiver(post_save, sender=Variant)
+@receiver(post_delete, sender=Variant)
+def invalidate_variants(sender, **kwargs):
+    transaction.on_commit(variants_cache.invalidate)
@@ -0,0 +1,46 @@
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+
+class VendorMixin:
+    """
+    Runs a migration operation only on the database ``vendor`` ('postgresql', 'sqlite');
+    on the other backends only the migration state is updated.
+    """
+
+    def __init__(self, vendor, *args, **kwargs):
+        self.vendor = vendor
+        super().__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, args, kwargs = super().deconstruct()
+        return name, [self.vendor, *args], kwargs
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == self.vendor:
+            super().database_forwards(app_label, schema_editor, from_state, to_state)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == self.vendor:
+            super().database_backwards(app_label, schema_editor, from_state, to_state)
+
+
+class VendorAddIndex(VendorMixin, migrations.AddIndex):
+    """
+    AddIndex for an index type only one backend has, e.g. a GinIndex. SQLite rebuilds a table
+    from the model state when altering it, which recreates such an index as a plain one, so
+    unapplying drops it on the other backends as well.
+    """
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor != self.vendor:
+            schema_editor.execute('DROP INDEX IF EXISTS %s' % schema_editor.quote_name(self.index.name))
+        super().database_backwards(app_label, schema_editor, from_state, to_state)
+
+
+class VendorRunSQL(VendorMixin, migrations.RunSQL):
+    """RunSQL in one backend's dialect."""
+
+
+class VendorTrigramExtension(VendorMixin, TrigramExtension):
+    """TrigramExtension that skips the other backends when unapplied too, not only when applied."""
@@ -1,9 +1,10 @@
 from django.contrib import admin
 from django.contrib.admin import ModelAdmin
-from django.db.models import Count, Sum
+from django.db.models import Count, Prefetch, Sum
 from apps.base.models import Profile
 
 from apps.order.models import CartItem, Cart, Order, Wishlist, Variant
+from apps.order.summary import CartSummary
 
 
 # Register your models here.
@@ -22,6 +23,25 @@ class CartAdmin(admin.ModelAdmin):
     list_filter = ('completed', 'created_at')
     list_per_page = 20
 
+    def get_queryset(self, request):
+        # the items of the whole page in one query, priced once per cart
+        return super().get_queryset(request).prefetch_related(
+            Prefetch('cart_items', queryset=CartItem.objects.select_related(*CartSummary.related).order_by('id')))
+
+    @staticmethod
+    def summary(obj):
+        if not hasattr(obj, '_summary'):
+            obj._summary = CartSummary(obj.cart_items.all())
+        return obj._summary
+
+    @admin.display(description='Num of items')
+    def num_of_items(self, obj):
+        return self.summary(obj).num_of_items
+
+    @admin.display(description='Cart total')
+    def cart_total(self, obj):
+        return self.summary(obj).total
+
 
 class OrderAdmin(admin.ModelAdmin):
     inlines = [CartItemAdmin]
@@ -1,10 +1,13 @@
 from django.db.models import Min
-from .models import Cart, Wishlist
-import uuid
+from django.utils.functional import SimpleLazyObject
+from .models import EmptyCart, Wishlist, get_cart, get_session_id
+from .summary import CartSummary
 from apps.contact.models import Subscribe
-from ..base.models import Variant
+from ..base.cache import ProcessCache
+from ..base.models import get_variants
 from django.http import JsonResponse
-from ..product.models import Currency, Category, Product, ProductImage
+from ..product.categories import get_category_tree
+from ..product.models import CATALOG_VERSION, Product, ProductImage, get_category_version, get_currency
 
 
 def ajax_renderer(request):
@@ -31,32 +34,70 @@ def ajax_renderer(request):
     return JsonResponse({'error': 'Invalid request method.'}, status=400)
 
 
+def load_catalog_globals():
+    from apps.product.pricing import price_products
+    products = Product.objects.exclude(uzs_price__isnull=True)
+    bounds = [products.order_by('-uzs_price', '-id').first(), products.order_by('uzs_price', 'id').first()]
+    price_products([product for product in bounds if product is not None])
+    return {
+        'max_price': bounds[0],
+        'min_price': bounds[1],
+    }
+
+
+catalog_globals = ProcessCache(CATALOG_VERSION, load_catalog_globals)
+
+
+def memoized(request, name, loader):
+    values = request.__dict__.setdefault('_cart_renderer', {})
+    if name not in values:
+        values[name] = loader()
+    return values[name]
+
+
+def lazy(request, name, loader):
+    """A value computed at most once per request, and only if a template touches it."""
+    return SimpleLazyObject(lambda: memoized(request, name, loader))
+
+
+def session_cart(request):
+    """``(cart, wishlists)`` of the session, once per request."""
+    return memoized(request, 'session_cart', lambda: load_cart(request))
+
+
+def cart_summary(request):
+    """The CartSummary of the session cart, once per request."""
+    return memoized(request, 'cart_summary', lambda: CartSummary.of(session_cart(request)[0]))
+
+
+def load_cart(request):
+    session_id = get_session_id(request)
+    wishlists = Wishlist.objects.filter(session_id=session_id) if session_id else None
+    return get_cart(request) or EmptyCart(), wishlists
+
+
 def cart_renderer(request):
-    currency = Currency.objects.last()
-    categories = Category.objects.filter(is_active=True)
+    """
+    Every value is lazy: a page pays only for what its templates use. The category tree and
+    the price bounds come from per-process caches refreshed when their version changes.
+    """
     sbb = request.POST.get('sbb')
-    subscribe = Subscribe.objects.filter(email=sbb)
-    variants = Variant.objects.all().order_by('duration')
-    max_price = Product.objects.latest('uzs_price')
-    min_price = Product.objects.earliest('uzs_price')
-    active_variant = variants.last()
-    if not subscribe.exists():
-        if request.method == 'POST':
-            Subscribe.objects.create(email=sbb)
-    try:
-        cart = Cart.objects.get(session_id=request.session['nonuser'], completed=False)
-        wishlists = Wishlist.objects.filter(session_id=request.session['nonuser'])
-    except:
-        request.session['nonuser'] = str(uuid.uuid4())
-        cart = Cart.objects.create(session_id=request.session['nonuser'])
-        wishlists = None
+    if request.method == 'POST' and sbb and not Subscribe.objects.filter(email=sbb).exists():
+        Subscribe.objects.create(email=sbb)
+
+    def active_variant():
+        variants = get_variants()
+        return variants[-1] if variants else None
 
     return {
-        "cart": cart,
-        "active_variant": active_variant,
-        "wishlists": wishlists,
-        "currency": currency,
-        'categories': categories,
-        'max_price': max_price,
-        'min_price': min_price,
+        "cart": lazy(request, 'cart', lambda: session_cart(request)[0]),
+        "active_variant": lazy(request, 'active_variant', active_variant),
+        "cart_summary": lazy(request, 'cart_summary', lambda: cart_summary(request)),
+        "wishlists": lazy(request, 'wishlists', lambda: session_cart(request)[1]),
+        "currency": lazy(request, 'currency', get_currency),
+        'categories': lazy(request, 'categories', lambda: get_category_tree().active),
+        'category_tree': lazy(request, 'category_tree', get_category_tree),
+        'category_version': lazy(request, 'category_version', get_category_version),
+        'max_price': lazy(request, 'max_price', lambda: catalog_globals.get()['max_price']),
+        'min_price': lazy(request, 'min_price', lambda: catalog_globals.get()['min_price']),
     }
@@ -0,0 +1,18 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from apps.order.models import Cart
+
+
+class Command(BaseCommand):
+    help = 'Delete open carts that never got an item (run it daily from cron, next to clearsessions)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=1, help='only carts untouched for this many days')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        deleted, _ = Cart.objects.filter(completed=False, cart_items__isnull=True, updated_at__lt=cutoff).delete()
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} empty carts'))
@@ -1,11 +1,14 @@
+import uuid
+
 from django.contrib.auth.models import User
 from django.db import models
 
-from apps.base.models import BaseAbstractDate, Variant
+from apps.base.models import BaseAbstractDate, Variant, get_variant
 from apps.product.models import Product, Color, Size, ProductImage
 
 
-# Create your models here.
+# session key of the anonymous visitor id the carts and wishlists are kept under
+SESSION_KEY = 'nonuser'
 
 
 class Cart(BaseAbstractDate):
@@ -14,18 +17,47 @@ class Cart(BaseAbstractDate):
 
     @property
     def num_of_items(self):
-        cart_items = self.cart_items.all()
-        return sum([i.quantity for i in cart_items])
+        from apps.order.summary import CartSummary
+        return CartSummary.of(self).num_of_items
 
     @property
     def cart_total(self):
-        cart_items = self.cart_items.all()
-        return sum([i.subtotal for i in cart_items])
+        from apps.order.summary import CartSummary
+        return CartSummary.of(self).total
 
     def __str__(self):
         return str(self.session_id)
 
 
+class EmptyCart:
+    """Stands in for the cart of a visitor who hasn't added anything yet; nothing is stored for it."""
+    id = None
+    completed = False
+    num_of_items = 0
+    cart_total = 0
+
+    @property
+    def cart_items(self):
+        return CartItem.objects.none()
+
+
+def get_session_id(request, create=False):
+    """The visitor id of the session, assigned on first use when ``create`` is set."""
+    session_id = request.session.get(SESSION_KEY)
+    if session_id is None and create:
+        session_id = request.session[SESSION_KEY] = str(uuid.uuid4())
+    return session_id
+
+
+def get_cart(request, create=False):
+    """The open cart of the session: None until the first cart action, which passes ``create``."""
+    session_id = get_session_id(request, create)
+    cart = Cart.objects.filter(session_id=session_id, completed=False).last() if session_id else None
+    if cart is None and create:
+        cart = Cart.objects.create(session_id=session_id)
+    return cart
+
+
 class Order(BaseAbstractDate):
     STATUS = (
         ('New', 'New'),
@@ -68,8 +100,9 @@ class CartItem(BaseAbstractDate):
 
     @property
     def subtotal(self):
-        return round(self.quantity * (
-                self.product_image.price_uzs + ((self.variant.percent * self.product_image.price_uzs) / 100)), 2)
+        variant = get_variant(self.variant_id) or self.variant
+        price_uzs = self.product_image.price_uzs
+        return round(self.quantity * (price_uzs + ((variant.percent * price_uzs) / 100)), 2)
 
 
 class Wishlist(BaseAbstractDate):
@@ -0,0 +1,49 @@
+from apps.base.models import get_longest_variant, get_variant
+from apps.product.models import Currency, get_currency_amount
+
+
+class CartSummary:
+    """
+    Item count, line totals and grand total of a cart, priced in one pass over its items.
+    The items should come with ``product`` and ``product_image`` selected (see ``related``);
+    variants are taken from the process-wide variant cache. Each item gets ``unit_total``
+    (the image price with the longest plan's markup, as shown per unit) and ``line_total``.
+    """
+    related = ('product', 'product_image')
+
+    def __init__(self, items):
+        self.items = list(items)
+        amounts = {}
+        for item in self.items:
+            product_type = item.product.product_type if item.product else 'product'
+            if product_type not in amounts:
+                try:
+                    amounts[product_type] = get_currency_amount(product_type)
+                except Currency.DoesNotExist:
+                    amounts[product_type] = 0
+            if item.product_image is not None:
+                price_uzs = int(item.product_image.price * amounts[product_type])
+            elif item.product is not None:
+                # items added from the wishlist have no image; the stored price is the first image's
+                price_uzs = item.product.uzs_price or 0
+            else:
+                price_uzs = 0
+            variant = get_variant(item.variant_id) if item.variant_id else None
+            if variant is not None:
+                item.variant = variant
+            else:
+                variant = get_longest_variant()
+            longest = get_longest_variant(product_type)
+            percent = variant.percent if variant else 0
+            item.unit_total = int(price_uzs + ((longest.percent if longest else 0) * price_uzs) / 100)
+            item.line_total = round(item.quantity * (price_uzs + (percent * price_uzs) / 100), 2)
+        self.count = len(self.items)
+        self.num_of_items = sum(item.quantity for item in self.items)
+        self.total = sum(item.line_total for item in self.items)
+
+    @classmethod
+    def of(cls, cart):
+        """The summary of a saved cart, in a single query."""
+        if cart is None or cart.id is None:
+            return cls([])
+        return cls(cart.cart_items.select_related(*cls.related).order_by('id'))
@@ -1,3 +1,94 @@
-from django.test import TestCase
+from datetime import timedelta
+from io import StringIO
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from apps.base.models import Variant
+from apps.order.models import Cart, CartItem
+from apps.order.summary import CartSummary
+from apps.product.models import Currency, Product, ProductImage
+from apps.product.tests import CatalogTestCase
+
+
+class DeferredCartTest(CatalogTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        Currency.objects.create(amount=10000)
+        self.variant = Variant.objects.create(product_type='product', duration=12, percent=30)
+        self.product = Product.objects.create(title='phone')
+
+    def test_browsing_creates_no_cart(self):
+        self.client.get('/about/')
+        self.client.get('/order/shop-cart/')
+        self.assertFalse(Cart.objects.exists())
+        self.assertNotIn('nonuser', self.client.session)
+
+    def test_first_add_to_cart_creates_it(self):
+        for _ in range(2):
+            response = self.client.post('/order/add-to-cart/', {
+                'product_id': self.product.id, 'quantity': 1, 'variant': self.variant.id})
+            self.assertTrue(response.json()['status'])
+        cart = Cart.objects.get()
+        self.assertEqual(cart.session_id, self.client.session['nonuser'])
+        self.assertEqual(CartItem.objects.get(cart=cart).quantity, 2)
+
+    def test_cleanup_keeps_recent_and_filled_carts(self):
+        old = timezone.now() - timedelta(days=2)
+        empty = Cart.objects.create(session_id='a')
+        filled = Cart.objects.create(session_id='b')
+        CartItem.objects.create(cart=filled, product=self.product, quantity=1)
+        recent = Cart.objects.create(session_id='c')
+        Cart.objects.filter(id__in=[empty.id, filled.id]).update(updated_at=old)
+        call_command('delete_empty_carts', stdout=StringIO())
+        self.assertEqual(set(Cart.objects.values_list('id', flat=True)), {filled.id, recent.id})
+
+
+class CartSummaryTest(CatalogTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        Currency.objects.create(amount=10000)
+        self.short = Variant.objects.create(product_type='product', duration=3, percent=10)
+        self.long = Variant.objects.create(product_type='product', duration=12, percent=30)
+        self.cart = Cart.objects.create(session_id='visitor')
+        for i in range(3):
+            product = Product.objects.create(title=f'phone {i}')
+            image = ProductImage.objects.create(product=product, image='products/test.png', price=10)
+            CartItem.objects.create(cart=self.cart, product=product, product_image=image, variant=self.short,
+                                    quantity=i + 1)
+
+    def test_summary_in_one_query(self):
+        CartSummary.of(self.cart)  # loads the variant and currency caches
+        with self.assertNumQueries(1):
+            summary = CartSummary.of(self.cart)
+        self.assertEqual((summary.count, summary.num_of_items, summary.total), (3, 6, 660000))
+        self.assertEqual([item.unit_total for item in summary.items], [130000] * 3)
+        with self.assertNumQueries(0):
+            [item.variant.duration for item in summary.items]
+
+    def test_header_and_cart_page(self):
+        session = self.client.session
+        session['nonuser'] = 'visitor'
+        session.save()
+        response = self.client.get('/order/shop-cart/')
+        content = response.content.decode().replace('\xa0', ' ')
+        self.assertEqual(content.count('130 000'), 6)  # unit prices in the header and the table
+        self.assertEqual(content.count('660 000,0 UZS'), 2)
+
+    def test_admin_columns_do_not_query_per_cart(self):
+        User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        self.client.login(username='admin', password='admin')
+        url = '/chocolate-admin/order/cart/'
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as small:
+            self.client.get(url)
+        for _ in range(3):
+            CartItem.objects.create(cart=Cart.objects.create(session_id='other'), product=Product.objects.first(),
+                                    variant=self.long, quantity=1)
+        with CaptureQueriesContext(connection) as large:
+            response = self.client.get(url)
+        self.assertEqual(len(small), len(large))
+        self.assertContains(response, '660000')
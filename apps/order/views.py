@@ -1,8 +1,10 @@
-from apps.product.models import Product, Rate, Category, Size, ProductImage
+from apps.product.models import Product, Rate, Size, ProductImage
 from django.shortcuts import render, redirect, get_object_or_404
-from apps.order.models import Cart, CartItem, Order, Wishlist
+from apps.order.context_processor import cart_summary, session_cart
+from apps.product.categories import get_category_tree
+from apps.order.models import Cart, CartItem, Order, Wishlist, get_cart, get_session_id
 from django.contrib.auth.decorators import login_required
-from apps.base.models import Variant
+from apps.base.models import Variant, get_longest_variant
 from django.http import JsonResponse
 from bot.main import order_product
 # message
@@ -23,13 +25,11 @@ def account(request):
 def add_to_cart(request):
     ids = 0
     if request.method == "POST":
-        session_id = request.session['nonuser']
         product_id = request.POST['product_id']
         product_image = request.POST.get('product_image', None)
         variant = request.POST.get('variant', None)
         quantity = request.POST['quantity']
         size = request.POST.get('size', None)
-        cart = get_object_or_404(Cart, session_id=session_id, completed=False)
         product = get_object_or_404(Product, id=product_id)
         has_size = False
         has_color = False
@@ -50,9 +50,9 @@ def add_to_cart(request):
             return JsonResponse({"msg": "Iltimos! o'lcham tanlang", "status": False})
 
         elif variant is None:
-            variants = Variant.objects.all().order_by('duration')
-            variant = variants.last().id
+            variant = get_longest_variant().id
         variant = get_object_or_404(Variant, id=variant)
+        cart = get_cart(request, create=True)
         cart_item = CartItem.objects.filter(cart=cart, product_id=product_id, variant=variant)
         if cart_item.exists():
             for i in cart_item:
@@ -133,7 +133,7 @@ def one_click_order(request):
         return JsonResponse({"msg": "Iltimos, mahsulotni tanlang!", "status": False})
 
     cart = Cart.objects.create(
-        session_id=request.session['nonuser'],
+        session_id=get_session_id(request, create=True),
         completed=True
     )
     order = Order()
@@ -229,13 +229,10 @@ def review(request):
 
 
 def shop_cart(request):
-    session_id = request.session['nonuser']
-    cart = Cart.objects.filter(session_id=session_id, completed=False)
-    category = Category.objects.all()
     context = {
-        'cart': cart.last(),
-        'categories': category[10:],
-        'hide_categories': category[10:],
+        'cart': session_cart(request)[0],
+        'cart_summary': cart_summary(request),
+        'hide_categories': get_category_tree().menu[10:],
     }
     return render(request, "shop-cart.html", context)
 
@@ -247,7 +244,7 @@ def delete_cart_item(request, id):
 
 
 def wishlist(request, id):
-    session_id = request.session['nonuser']
+    session_id = get_session_id(request, create=True)
     product = get_object_or_404(Product, id=id)
     url = request.META.get('HTTP_REFERER')
 
@@ -273,8 +270,8 @@ def delete_wishlist(request, id):
 
 def create_order_wishlist(request, id):
     product = Product.objects.get(id=id)
-    session_id = request.session['nonuser']
-    cart = Cart.objects.get(session_id=session_id, completed=False)
+    session_id = get_session_id(request, create=True)
+    cart = get_cart(request, create=True)
     cart_item = CartItem.objects.create(
         product=product,
         quantity=1,
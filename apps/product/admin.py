@@ -59,10 +59,9 @@ class ProductAdmin(TranslationAdmin):
         'title', 'percentage', 'discount_uzs', 'mid_rate', 'view', 'is_active', 'id','price_uzs',"uzs_price"
     )
     search_fields = ('title',)
-    readonly_fields = ('mid_rate', 'discount_uzs', 'discount', 'view', 'get_discount_price')
+    readonly_fields = ('mid_rate', 'discount_uzs', 'discount', 'view', 'get_discount_price', 'uzs_price')
     list_filter = ('product_type', 'is_active', 'status', 'brand', 'updated_at', 'created_at')
     list_per_page = 50
-    readonly_fields = ('uzs_price',)
 
     group_fieldsets = True
 
@@ -2,17 +2,65 @@ import datetime
 import django_filters
 from django_filters import rest_framework as filters
 from django.db.models import Q
-from apps.product.models import Brand, Category, Product, PRODUCT_TYPE, Size, Author, Color, ProductImage
+from rest_framework.filters import SearchFilter
+from apps.product.facets import FACETS
+from apps.product.search import search_products
+from apps.product.models import Brand, Category, Product, PRODUCT_TYPE, Size, Author, Color, ProductImage, LANGUAGE, \
+    YOZUV, MUQOVA
+
+TRUE_VALUES = ('1', 'true', 'yes')
 
 
 class AppProductFilter(django_filters.FilterSet):
     title = django_filters.CharFilter(field_name='title', lookup_expr='icontains')
-    brand = django_filters.ModelMultipleChoiceFilter(queryset=Brand.objects.all())
-    category = django_filters.ModelChoiceFilter(queryset=Category.objects.filter(parent__isnull=False))
+    brand = django_filters.ModelMultipleChoiceFilter(queryset=Brand.objects.all(), method='filter_facet')
+    category = django_filters.ModelMultipleChoiceFilter(queryset=Category.objects.filter(parent__isnull=False),
+                                                        method='filter_facet')
     product_type = django_filters.ChoiceFilter(choices=PRODUCT_TYPE, field_name='product_type', lookup_expr='exact')
-    author = django_filters.ModelChoiceFilter(queryset=Author.objects.all(), field_name='author', lookup_expr='exact')
-    size = django_filters.ModelMultipleChoiceFilter(queryset=Size.objects.all())
+    author = django_filters.ModelMultipleChoiceFilter(queryset=Author.objects.all(), method='filter_facet')
+    size = django_filters.ModelMultipleChoiceFilter(queryset=Size.objects.all(), method='filter_facet')
+    color = django_filters.ModelMultipleChoiceFilter(queryset=Color.objects.all(), method='filter_facet')
+    language = django_filters.MultipleChoiceFilter(choices=LANGUAGE, method='filter_facet')
+    yozuv = django_filters.MultipleChoiceFilter(choices=YOZUV, method='filter_facet')
+    wrapper = django_filters.MultipleChoiceFilter(choices=MUQOVA, method='filter_facet')
+    price_min = django_filters.NumberFilter(field_name='uzs_price', lookup_expr='gte')
+    price_max = django_filters.NumberFilter(field_name='uzs_price', lookup_expr='lte')
 
     class Meta:
         model = Product
         fields = ['title', 'category', 'brand', 'size', 'author', 'product_type']
+
+    def filter_facet(self, queryset, name, value):
+        if not value:
+            return queryset
+        values = [getattr(item, 'pk', item) for item in value]
+        return queryset.filter(FACETS[name].condition(values))
+
+    def filter_without_facets(self, queryset):
+        """Apply the bound filters except the facets, which FacetEngine combines itself."""
+        for name, value in self.form.cleaned_data.items():
+            if name not in FACETS:
+                queryset = self.filters[name].filter(queryset, value)
+        return queryset
+
+    @property
+    def facet_selection(self):
+        """The facet values of a bound and valid filter, in the shape FacetEngine expects."""
+        return {
+            name: [getattr(item, 'pk', item) for item in self.form.cleaned_data.get(name) or ()]
+            for name in FACETS
+        }
+
+
+class FullTextSearchFilter(SearchFilter):
+    """
+    ``?search=`` over the product search index instead of icontains scans, best match first.
+    ``&fuzzy=1`` switches to the typo-tolerant trigram search.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        query = request.query_params.get(self.search_param, '')
+        if not query.strip():
+            return queryset
+        fuzzy = request.query_params.get('fuzzy', '').lower() in TRUE_VALUES
+        return search_products(queryset, query, fuzzy=fuzzy)
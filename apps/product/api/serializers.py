@@ -1,6 +1,8 @@
 from rest_framework import serializers
+from api.product.serializers import PricedListSerializer
 from apps.product.models import Author, BannerDiscount, Currency, Advertisement, Category, Banner, Brand, Color, Size, \
     Product, ProductImage, AdditionalInfo, Rate
+from apps.product.gallery import Gallery
 
 
 class AppBannerDiscountSerializer(serializers.ModelSerializer):
@@ -110,6 +112,7 @@ class AppProductSerializer(serializers.ModelSerializer):
             'id', 'status', 'title', 'category', 'percentage', 'monthly_uzs', 'discount_uzs',
             'mid_rate_percent', 'product_images'
         )
+        list_serializer_class = PricedListSerializer
 
 
 class AppProductDetailSerializer(serializers.ModelSerializer):
@@ -146,10 +149,8 @@ class ProductRetrieveSerializer(serializers.ModelSerializer):
     
     
     def get_colors(self,obj):
-        if obj.product_type == 'book':
-            return  obj.product_images.distinct('wrapper').values('id','image')
-        else:
-            return  obj.product_images.distinct('color').values('id','image')
+        return [{'id': image.id, 'image': image.image.name}
+                for image in Gallery(obj, obj.product_images.all()).covers]
     
     class Meta:
         model = Product
@@ -1,21 +1,25 @@
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import mixins, viewsets, filters
 from rest_framework.decorators import action
+from rest_framework.response import Response
+from rest_framework.exceptions import ValidationError
 from api.book.helper import LargeResultsSetPagination
-from .filters import AppProductFilter
+from .filters import AppProductFilter, FullTextSearchFilter
+from django.db.models import Prefetch
+from apps.product.facets import FacetEngine
 from apps.product.models import Product, ProductImage
 from .serializers import AppProductSerializer, AppProductDetailSerializer
 
 
 class AppProductViewSet(mixins.ListModelMixin, mixins.RetrieveModelMixin, viewsets.GenericViewSet):
     serializer_class = AppProductSerializer
-    filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
+    filter_backends = [DjangoFilterBackend, FullTextSearchFilter, filters.OrderingFilter]
     filterset_class = AppProductFilter
-    search_fields = ['title', 'description']
     pagination_class = LargeResultsSetPagination
 
     def get_queryset(self):
-        return Product.objects.filter(is_active=True)
+        return Product.objects.filter(is_active=True).prefetch_related(
+            'category', Prefetch('product_images', queryset=ProductImage.objects.select_related('color')))
 
     def get_serializer_class(self):
         if self.action == 'list':
@@ -23,3 +27,13 @@ class AppProductViewSet(mixins.ListModelMixin, mixins.RetrieveModelMixin, viewse
         elif self.action == 'retrieve':
             return AppProductDetailSerializer
         return AppProductSerializer
+
+    @action(detail=False, methods=['get'])
+    def facets(self, request, *args, **kwargs):
+        """Product counts of every facet value for the current filters, e.g. ``?product_type=book&language=uzbek``."""
+        queryset = FullTextSearchFilter().filter_queryset(request, Product.objects.filter(is_active=True), self)
+        filterset = self.filterset_class(request.GET, queryset=queryset, request=request)
+        if not filterset.is_valid():
+            raise ValidationError(filterset.errors)
+        engine = FacetEngine(filterset.filter_without_facets(queryset), filterset.facet_selection)
+        return Response(engine.counts())
@@ -0,0 +1,33 @@
+from apps.base.cache import ProcessCache
+from apps.product.models import CATEGORY_VERSION, Category
+
+
+class CategoryTree:
+    """
+    Every category fetched in one query with get_cached_trees(), so get_children() never
+    queries. ``menu`` holds the active top-level categories, each with its active children
+    as ``menu_children`` (a child of an inactive category is left out); ``active`` lists
+    the categories of the menu in tree order and ``subcategories`` those below the top level.
+    """
+
+    def __init__(self, categories):
+        self.roots = categories.get_cached_trees()
+        self.active = []
+        self.menu = self._menu(self.roots)
+        self.subcategories = [category for category in self.active if category.parent_id is not None]
+
+    def _menu(self, nodes):
+        menu = []
+        for node in nodes:
+            if node.is_active:
+                self.active.append(node)
+                node.menu_children = self._menu(node.get_children())
+                menu.append(node)
+        return menu
+
+
+category_tree = ProcessCache(CATEGORY_VERSION, lambda: CategoryTree(Category.objects.all()))
+
+
+def get_category_tree():
+    return category_tree.get()
@@ -0,0 +1,53 @@
+import threading
+import time
+from collections import Counter
+
+from django.db.models import F, Value
+from django.db.models.functions import Coalesce
+
+from apps.base.jobs import BackgroundJob
+from apps.product.models import Product
+
+
+class ViewCounter:
+    """
+    Product page views counted in memory and written every ``flush_interval`` seconds by a
+    background thread with its own database connection, started by the view that crosses the
+    interval, as one ``view = view + n`` UPDATE per distinct ``n``. QuerySet.update skips the
+    save signals and leaves ``updated_at`` alone. Views still buffered when the worker exits
+    are lost, so the counts are a lower bound.
+    """
+
+    def __init__(self, flush_interval=30):
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._views = Counter()
+        self._flushed_at = time.monotonic()
+        self._flusher = BackgroundJob(self.flush, 'flush-views')
+
+    def add(self, product_id, count=1):
+        with self._lock:
+            self._views[product_id] += count
+            due = time.monotonic() - self._flushed_at >= self.flush_interval
+        if due:
+            self._flusher.start()
+
+    def clear(self):
+        with self._lock:
+            self._views = Counter()
+            self._flushed_at = time.monotonic()
+
+    def flush(self):
+        """Write the buffered views; returns how many were written."""
+        with self._lock:
+            views, self._views = self._views, Counter()
+            self._flushed_at = time.monotonic()
+        by_count = {}
+        for product_id, count in views.items():
+            by_count.setdefault(count, []).append(product_id)
+        for count, ids in by_count.items():
+            Product.objects.filter(id__in=ids).update(view=Coalesce(F('view'), Value(0)) + count)
+        return sum(views.values())
+
+
+view_counter = ViewCounter()
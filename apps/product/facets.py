@@ -0,0 +1,94 @@
+from django.db.models import CharField, Count, Exists, OuterRef, Q, Value
+from django.db.models.functions import Cast
+
+from apps.product.models import Product, ProductImage
+
+
+class Facet:
+    """
+    One sidebar filter. ``field`` is a column of Product, or of ``model`` (a table with a
+    ``product`` foreign key) for the multi-valued ones, which are matched with EXISTS so a
+    selection never duplicates products. The selected values of a facet are OR-ed.
+    """
+
+    def __init__(self, name, field, model=None, cast=int):
+        self.name = name
+        self.field = field
+        self.model = model
+        self.cast = cast
+
+    def condition(self, values):
+        lookup = {f'{self.field}__in': values}
+        if self.model is None:
+            return Q(**lookup)
+        return Exists(self.model.objects.filter(product_id=OuterRef('pk'), **lookup))
+
+    def counts(self, products):
+        """``(facet, value, count)`` rows of the given products, grouped by the value of this facet."""
+        if self.model is None:
+            rows, product = products.order_by(), 'id'
+        else:
+            rows, product = self.model.objects.filter(product__in=products.order_by().values('pk')), 'product_id'
+        return rows.filter(**{f'{self.field}__isnull': False}).order_by() \
+            .annotate(value=Cast(self.field, CharField())).values('value') \
+            .annotate(count=Count(product, distinct=True), facet=Value(self.name, output_field=CharField())) \
+            .values_list('facet', 'value', 'count')
+
+
+FACETS = {facet.name: facet for facet in (
+    Facet('category', 'category_id', Product.category.through),
+    Facet('brand', 'brand_id'),
+    Facet('author', 'author_id'),
+    Facet('language', 'language', cast=str),
+    Facet('yozuv', 'yozuv', cast=str),
+    Facet('wrapper', 'wrapper', ProductImage, cast=str),
+    Facet('color', 'color_id', ProductImage),
+    Facet('size', 'size_id', Product.size.through),
+)}
+
+
+class FacetEngine:
+    """
+    Filters ``queryset`` by a facet selection, AND between facets and OR within one, and
+    counts the products of every facet value for the current selection.
+    ``selection`` maps facet names to lists of values; empty lists are ignored.
+    """
+
+    def __init__(self, queryset, selection, price_min=None, price_max=None):
+        self.queryset = queryset
+        self.selection = {name: list(values) for name, values in selection.items() if values}
+        self.price_min = price_min
+        self.price_max = price_max
+
+    def filter(self, exclude=None):
+        """The products matching the selection, ignoring the facet ``exclude``."""
+        queryset = self.queryset
+        if self.price_min:
+            queryset = queryset.filter(uzs_price__gte=self.price_min)
+        if self.price_max:
+            queryset = queryset.filter(uzs_price__lte=self.price_max)
+        for name, values in self.selection.items():
+            if name != exclude:
+                queryset = queryset.filter(FACETS[name].condition(values))
+        return queryset
+
+    def counts(self, facets=None):
+        """
+        ``{facet: {value: count}}`` in a single UNION query. The counts of a facet ignore its
+        own selection, so they tell how many products each alternative value would show.
+        """
+        facets = [FACETS[name] for name in (facets or FACETS)]
+        result = {facet.name: {} for facet in facets}
+        if not facets:
+            return result
+        queries = [facet.counts(self.filter(exclude=facet.name)) for facet in facets]
+        for name, value, count in queries[0].union(*queries[1:], all=True):
+            result[name][FACETS[name].cast(value)] = count
+        return result
+
+
+def attach_counts(objects, counts):
+    """Set ``facet_count`` on each sidebar object from the counts of its facet."""
+    for obj in objects:
+        obj.facet_count = counts.get(obj.id, 0)
+    return objects
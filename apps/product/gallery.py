@@ -0,0 +1,44 @@
+from apps.product.models import MUQOVA
+
+
+class Gallery:
+    """
+    The images of one product grouped in a single pass: by wrapper for books, by color
+    otherwise. ``groups`` keeps the order in which the groups first appear.
+    ``images`` may be a prefetched list; otherwise the images are loaded with one query.
+    """
+
+    def __init__(self, product, images=None):
+        self.product = product
+        self.key = 'wrapper' if product.product_type == 'book' else 'color_id'
+        if images is None:
+            images = product.product_images.select_related('color').order_by('id')
+        self.groups = {}
+        for image in images:
+            image.product = product
+            self.groups.setdefault(getattr(image, self.key), []).append(image)
+
+    @property
+    def covers(self):
+        """The first image of every group, in order of appearance."""
+        return [images[0] for images in self.groups.values()]
+
+    @property
+    def representatives(self):
+        """The first image of every group, the largest groups first (the storefront swatches)."""
+        return [images[0] for images in sorted(self.groups.values(), key=len, reverse=True)]
+
+    @property
+    def default(self):
+        """The group of the first image, shown before a swatch is picked."""
+        return next(iter(self.groups.values()), [])
+
+    def as_list(self, serialize):
+        """``[{color_id, color_title | wrapper, price, images}]`` with ``serialize(images)`` as the images."""
+        if self.key == 'wrapper':
+            return [{'wrapper': wrapper, 'price': self.groups[wrapper][0].price,
+                     'images': serialize(self.groups[wrapper])}
+                    for wrapper, _ in MUQOVA if wrapper in self.groups]
+        return [{'color_id': images[0].color.id, 'color_title': images[0].color.title, 'price': images[0].price,
+                 'images': serialize(images)}
+                for color_id, images in self.groups.items() if color_id is not None]
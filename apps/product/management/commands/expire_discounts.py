@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from apps.product.models import BannerDiscount
+
+
+class Command(BaseCommand):
+    help = 'Deactivate the banner discounts past their deadline (run it every minute from cron)'
+
+    def handle(self, *args, **options):
+        expired = BannerDiscount.expire()
+        self.stdout.write(self.style.SUCCESS(f'Expired {expired} banner discounts'))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from apps.product.models import Product
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the denormalized rating aggregates (rate_sum, rate_count, rate_avg) of products'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--product', type=int, nargs='*', help='Only rebuild the given product ids')
+
+    def handle(self, *args, **options):
+        queryset = Product.objects.all()
+        if options['product']:
+            queryset = queryset.filter(id__in=options['product'])
+        updated = Product.rebuild_rates(queryset)
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt rates of {updated} products'))
@@ -0,0 +1,19 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from apps.product.related import RELATED_LIMIT, rebuild_related
+
+
+class Command(BaseCommand):
+    help = 'Precompute the related products shown on product pages (run it periodically, e.g. hourly from cron)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=RELATED_LIMIT)
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        written = rebuild_related(limit=options['limit'], chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Stored {written} related products in {time.monotonic() - started:.1f}s'))
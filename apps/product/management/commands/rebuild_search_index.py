@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from apps.product.models import Product
+from apps.product.search import index_products, install_fts_triggers
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search document (and tsvector on PostgreSQL) of products; on SQLite ' \
+           'also reinstall the FTS triggers a migration that rebuilt product_product has dropped'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--product', type=int, nargs='*', help='Only rebuild the given product ids')
+
+    def handle(self, *args, **options):
+        if install_fts_triggers():
+            self.stdout.write('Reinstalled the SQLite full-text search triggers')
+        queryset = Product.objects.all()
+        if options['product']:
+            queryset = queryset.filter(id__in=options['product'])
+        updated = index_products(queryset)
+        self.stdout.write(self.style.SUCCESS(f'Reindexed {updated} products'))
@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from apps.product.pricing import reprice_pending, reprice_products
+
+
+class Command(BaseCommand):
+    help = 'Recompute the stored uzs_price of every product from the current exchange rates ' \
+           '(--pending finishes the currency and variant changes a stopped worker left unapplied)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=5000)
+        parser.add_argument('--pending', action='store_true',
+                            help='Only apply the currency and variant changes that have not been applied yet')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+
+        def progress(done, total):
+            self.stdout.write(f'{done}/{total} products repriced')
+
+        reprice = reprice_pending if options['pending'] else reprice_products
+        updated = reprice(chunk_size=options['chunk_size'], progress=progress)
+        self.stdout.write(self.style.SUCCESS(
+            f'Repriced {updated} products in {time.monotonic() - started:.1f}s'))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from apps.product.models import Product
+
+
+class Command(BaseCommand):
+    help = 'Regenerate the random storefront order of products (run it periodically, e.g. hourly from cron)'
+
+    def handle(self, *args, **options):
+        updated = Product.reshuffle()
+        self.stdout.write(self.style.SUCCESS(f'Reshuffled {updated} products'))
@@ -0,0 +1,95 @@
+# Generated by Django 4.2.3 on 2026-10-18 14:16
+# Catch-up migration: the models had drifted from the committed migrations, so a database
+# that was built from the models (or from migrations never committed) already has these
+# columns and tables. On such a database record it without running it:
+#     manage.py migrate product 0010 --fake
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0009_auto_20230406_2120'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Author',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('name', models.CharField(blank=True, max_length=255, null=True)),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.AddField(
+            model_name='brand',
+            name='product_type',
+            field=models.CharField(choices=[('book', 'Book'), ('clothing', 'Clothing'), ('product', 'Product')], default='product', max_length=25),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='product_type',
+            field=models.CharField(choices=[('book', 'Book'), ('clothing', 'Clothing'), ('product', 'Product')], default='product', max_length=25),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='language',
+            field=models.CharField(choices=[('english', 'english'), ('russian', 'russian'), ('uzbek', 'uzbek')], default='uzbek', max_length=25),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='product_type',
+            field=models.CharField(choices=[('book', 'Book'), ('clothing', 'Clothing'), ('product', 'Product')], default='product', max_length=25),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='uzs_price',
+            field=models.IntegerField(blank=True, default=0, null=True),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='yozuv',
+            field=models.CharField(choices=[('krill', 'Krill'), ('lotin', 'Lotin')], default='lotin', max_length=25),
+        ),
+        migrations.AddField(
+            model_name='productimage',
+            name='wrapper',
+            field=models.CharField(blank=True, choices=[('qattiq', 'qattiq'), ('yumshoq', 'yumshoq')], max_length=25, null=True, verbose_name='Muqova'),
+        ),
+        migrations.AddField(
+            model_name='size',
+            name='product_type',
+            field=models.CharField(choices=[('book', 'Book'), ('clothing', 'Clothing'), ('product', 'Product')], default='product', max_length=25),
+        ),
+        migrations.AlterField(
+            model_name='product',
+            name='is_active',
+            field=models.BooleanField(db_index=True, default=True),
+        ),
+        migrations.AlterField(
+            model_name='productimage',
+            name='color',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='product_images', to='product.color'),
+        ),
+        migrations.AlterField(
+            model_name='productimage',
+            name='image',
+            field=models.FileField(upload_to='products'),
+        ),
+        migrations.AlterField(
+            model_name='productimage',
+            name='product',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='product_images', to='product.product'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='author',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='product.author'),
+        ),
+    ]
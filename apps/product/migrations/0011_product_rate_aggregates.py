@@ -0,0 +1,40 @@
+# Generated by Django 4.2.3 on 2026-10-18 14:16
+
+from django.db import migrations, models
+
+
+def fill_rate_aggregates(apps, schema_editor):
+    Product = apps.get_model('product', 'Product')
+    Rate = apps.get_model('product', 'Rate')
+    totals = Rate.objects.order_by().values('product').annotate(total=models.Sum('rate'), count=models.Count('id'))
+    products = []
+    for row in totals:
+        products.append(Product(id=row['product'], rate_sum=row['total'], rate_count=row['count'],
+                                rate_avg=row['total'] / row['count']))
+    Product.objects.bulk_update(products, ['rate_sum', 'rate_count', 'rate_avg'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0010_author_product_type'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='rate_avg',
+            field=models.FloatField(db_index=True, default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rate_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rate_sum',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(fill_rate_aggregates, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.3 on 2026-10-18 14:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0011_product_rate_aggregates'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='discount_price',
+            field=models.IntegerField(db_index=True, default=0, editable=False),
+        ),
+    ]
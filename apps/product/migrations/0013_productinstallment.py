@@ -0,0 +1,30 @@
+# Generated by Django 4.2.3 on 2026-10-18 14:19
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0002_variant_type_profile'),
+        ('product', '0012_product_discount_price'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductInstallment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('total', models.IntegerField(default=0)),
+                ('monthly', models.IntegerField(default=0)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='installments', to='product.product')),
+                ('variant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='installments', to='base.variant')),
+            ],
+            options={
+                'unique_together': {('product', 'variant')},
+            },
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 4.2.3 on 2026-10-18 14:20
+
+import apps.product.models
+from django.db import migrations, models
+from django.db.models.functions import Cast, Random
+
+
+SHUFFLE_KEY_MAX = 2 ** 31 - 1
+
+
+def shuffle_products(apps, schema_editor):
+    # AddField gives every existing row the same default
+    Product = apps.get_model('product', 'Product')
+    Product.objects.update(shuffle_key=Cast(Random() * SHUFFLE_KEY_MAX, models.IntegerField()))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0013_productinstallment'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='shuffle_key',
+            field=models.IntegerField(default=apps.product.models.random_shuffle_key, editable=False),
+        ),
+        migrations.RunPython(shuffle_products, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['is_active', 'product_type', 'shuffle_key', 'id'], name='product_pro_is_acti_301267_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.3 on 2026-10-18 14:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0014_product_shuffle_key'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['percentage', 'is_active', 'product_type'], name='product_pro_percent_068249_idx'),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 4.2.3 on 2026-10-18 14:24
+
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+
+import apps.base.operations
+
+FTS_TABLE = 'product_search'
+
+# AddField rebuilds product_product on SQLite, which drops the FTS5 triggers of 0016
+SQLITE_FTS_TRIGGERS = [
+    f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON product_product BEGIN "
+    f"INSERT INTO {FTS_TABLE}(rowid, search_document) VALUES (new.id, new.search_document); END",
+    f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON product_product BEGIN "
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, search_document) VALUES ('delete', old.id, old.search_document); END",
+    f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF search_document ON product_product BEGIN "
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, search_document) VALUES ('delete', old.id, old.search_document); "
+    f"INSERT INTO {FTS_TABLE}(rowid, search_document) VALUES (new.id, new.search_document); END",
+]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0016_product_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='search_key',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+        apps.base.operations.VendorRunSQL('sqlite', SQLITE_FTS_TRIGGERS, reverse_sql=migrations.RunSQL.noop),
+        apps.base.operations.VendorTrigramExtension('postgresql'),
+        apps.base.operations.VendorAddIndex(
+            'postgresql',
+            model_name='product',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_key'], name='product_search_key_trgm',
+                                                           opclasses=['gin_trgm_ops']),
+        ),
+    ]
@@ -1,13 +1,21 @@
+import random
+
 from django.contrib.auth.models import User
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
 from ckeditor.fields import RichTextField
-from django.db.models import Avg
+from django.db.models import Count, Sum, F, Value, FloatField
+from django.db.models.functions import Cast, Coalesce, NullIf, Random
+from django.utils import timezone
 from django.utils.html import format_html
 from django.utils.safestring import mark_safe
 from mptt.models import MPTTModel
-from apps.base.models import BaseAbstractDate, Variant
+from apps.base.cache import ProcessCache, bump_version, get_version
+from apps.base.models import BaseAbstractDate, Variant, get_cheapest_variant, get_last_variant, get_longest_variant
 from colorfield.fields import ColorField
-from django.db.models.signals import post_save,pre_save, post_delete
+from django.db.models.signals import post_save,pre_save, post_delete, m2m_changed
+from django.db import transaction
 from django.dispatch import receiver
 from rembg import remove
 from PIL import Image
@@ -55,6 +63,21 @@ class BannerDiscount(BaseAbstractDate):
     def __str__(self):
         return f'{self.deadline}'
 
+    @classmethod
+    def running(cls, now=None):
+        """Active discounts whose deadline hasn't passed, whether or not expire() has caught up yet."""
+        now = now or timezone.now()
+        return cls.objects.filter(models.Q(deadline__isnull=True) | models.Q(deadline__gt=now), is_active=True)
+
+    @classmethod
+    def expire(cls, now=None):
+        """Deactivate every discount past its deadline in one UPDATE (run by the expire_discounts command)."""
+        expired = cls.objects.filter(is_active=True, deadline__lte=now or timezone.now()).update(is_active=False)
+        if expired:
+            # QuerySet.update sends no signals, so drop the cached homepage fragments here
+            bump_version(CATALOG_VERSION)
+        return expired
+
     # def get_absolute_url(self):
     #     return reverse("")
 
@@ -66,6 +89,40 @@ class Currency(BaseAbstractDate):
         return str(self.amount)
 
 
+currencies_cache = ProcessCache('currencies', lambda: list(Currency.objects.all().order_by('id')))
+
+
+def get_currency(product_type='product'):
+    """Books and clothing are priced with the currency row id=2, appliances with the latest one."""
+    currencies = currencies_cache.get()
+    if product_type != 'product':
+        return next((currency for currency in currencies if currency.id == 2), None)
+    return currencies[-1] if currencies else None
+
+
+def get_currency_amount(product_type='product'):
+    currency = get_currency(product_type)
+    if currency is None:
+        raise Currency.DoesNotExist
+    return currency.amount
+
+
+CATALOG_VERSION = 'catalog'
+
+
+def get_catalog_version():
+    """Version stamp of the cached storefront fragments, bumped after every catalog write commits."""
+    return get_version(CATALOG_VERSION)
+
+
+CATEGORY_VERSION = 'categories'
+
+
+def get_category_version():
+    """Version stamp of the cached category tree and menus, bumped after every category write commits."""
+    return get_version(CATEGORY_VERSION)
+
+
 class Advertisement(BaseAbstractDate):
     icon = models.ImageField(upload_to='advertisement/icons/', null=True, blank=True)
     title = models.CharField(max_length=223, null=True)
@@ -153,6 +210,17 @@ class Author(BaseAbstractDate):
         return 'No name'
 
 
+SHUFFLE_KEY_MAX = 2 ** 31 - 1
+
+
+def random_shuffle_key():
+    return random.randint(0, SHUFFLE_KEY_MAX)
+
+
+# products with at least this percentage off are featured in the discount blocks
+DISCOUNT_FEED_PERCENTAGE = 20
+
+
 class Product(BaseAbstractDate):
     # product and clothing
     banner_discount = models.ForeignKey(BannerDiscount, on_delete=models.SET_NULL, null=True, blank=True)
@@ -176,7 +244,29 @@ class Product(BaseAbstractDate):
     language = models.CharField(max_length=25, choices=LANGUAGE, default='uzbek')
     yozuv = models.CharField(max_length=25, choices=YOZUV, default='lotin')
     uzs_price = models.IntegerField(null=True,blank=True, default=0)
-
+    # discounted uzs_price, maintained together with uzs_price and discount by reprice_products
+    discount_price = models.IntegerField(default=0, editable=False, db_index=True)
+    # rating aggregates, maintained by the Rate signals below
+    rate_sum = models.IntegerField(default=0, editable=False)
+    rate_count = models.IntegerField(default=0, editable=False)
+    rate_avg = models.FloatField(default=0, editable=False, db_index=True)
+    # random storefront order, regenerated by the shuffle_products command
+    shuffle_key = models.IntegerField(default=random_shuffle_key, editable=False)
+    # full-text search, maintained by apps.product.search.index_products
+    search_document = models.TextField(default='', blank=True, editable=False)
+    # folded title, brand, author and categories for the fuzzy (trigram) search
+    search_key = models.TextField(default='', blank=True, editable=False)
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['is_active', 'product_type', 'shuffle_key', 'id']),
+            models.Index(fields=['percentage', 'is_active', 'product_type']),
+            # created on PostgreSQL only, see migration 0016; SQLite searches an FTS5 table instead
+            GinIndex(fields=['search_vector'], name='product_search_vector_gin'),
+            # pg_trgm index of the fuzzy search, PostgreSQL only as well (migration 0017)
+            GinIndex(fields=['search_key'], name='product_search_key_trgm', opclasses=['gin_trgm_ops']),
+        ]
 
     @property
     def get_discount(self):
@@ -188,29 +278,59 @@ class Product(BaseAbstractDate):
 
     @property
     def mid_rate(self):
-        result = Rate.objects.filter(product=self.id).aggregate(avarage=Avg("rate"))
-        if result['avarage']:
-            return round(result['avarage'], 1)
+        if self.rate_avg:
+            return round(self.rate_avg, 1)
         else:
             return 0.0
 
     @property
     def mid_rate_percent(self):
-        result = Rate.objects.filter(product=self.id).aggregate(avarage=Avg("rate"))
-        if result['avarage']:
-            percent = result['avarage'] * 100 / 5
+        if self.rate_avg:
+            percent = self.rate_avg * 100 / 5
             return percent
         else:
             return 0.0
 
+    @classmethod
+    def discounted(cls, queryset=None, min_percentage=DISCOUNT_FEED_PERCENTAGE):
+        """The discount feed: products of ``queryset`` with at least ``min_percentage`` off, filtered in SQL."""
+        if queryset is None:
+            queryset = cls.objects.filter(is_active=True).order_by('shuffle_key', 'id')
+        return queryset.filter(percentage__gte=min_percentage)
+
+    @classmethod
+    def reshuffle(cls, queryset=None):
+        """Give every product a new random shuffle_key in one UPDATE; the cached listings follow on commit."""
+        if queryset is None:
+            queryset = cls.objects.all()
+        updated = queryset.update(shuffle_key=Cast(Random() * SHUFFLE_KEY_MAX, models.IntegerField()))
+        transaction.on_commit(lambda: bump_version(CATALOG_VERSION))
+        return updated
+
+    @classmethod
+    def rebuild_rates(cls, queryset=None):
+        """Recompute rate_sum/rate_count/rate_avg from the Rate table in bulk."""
+        if queryset is None:
+            queryset = cls.objects.all()
+        totals = {
+            row['product']: row
+            for row in Rate.objects.filter(product__in=queryset).values('product').annotate(
+                total=Sum('rate'), count=Count('id'))
+        }
+        products = []
+        for product in queryset.only('id', 'rate_sum', 'rate_count', 'rate_avg'):
+            row = totals.get(product.id)
+            product.rate_sum = row['total'] if row else 0
+            product.rate_count = row['count'] if row else 0
+            product.rate_avg = product.rate_sum / product.rate_count if product.rate_count else 0
+            products.append(product)
+        cls.objects.bulk_update(products, ['rate_sum', 'rate_count', 'rate_avg'], batch_size=500)
+        return len(products)
+
     @property
     def get_discount_price(self):
         if self.percentage:
-            discount_sell = self.product_images.first().price - (
-                    self.product_images.first().price * (self.percentage / 100))
-            self.discount = discount_sell
-            self.save()
-            return discount_sell
+            return self.discount
         return 0
 
     def __str__(self):
@@ -229,33 +349,52 @@ class Product(BaseAbstractDate):
 
     @property
     def price_uzs(self):
+        prices = getattr(self, '_prices', None)
+        if prices is not None:
+            return prices.price_uzs
         try:
-            if self.product_type != 'product':
-                price = int(self.product_images.first().price * Currency.objects.get(id=2).amount)
-            else:
-                price = int(self.product_images.first().price * Currency.objects.last().amount)
+            price = int(self.product_images.first().price * get_currency_amount(self.product_type))
             return price
         except Exception as e:
             return 0  # "%s%s" % (intcomma(int(price)), ("%0.2f" % price)[-3:])
 
     @property
     def discount_uzs(self):
-        if self.product_type != 'product':
-            discount = int(self.discount * Currency.objects.get(id=2).amount)
-        else:
-            discount = int(self.discount * Currency.objects.last().amount)
+        prices = getattr(self, '_prices', None)
+        if prices is not None:
+            return prices.discount_uzs
+        discount = int(self.discount * get_currency_amount(self.product_type))
         return discount  # f"%s%s" % (intcomma(int(discount)), ("%0.2f" % discount)[-3:])
 
+    def get_installment(self, variant):
+        for installment in self.installments.all():
+            if installment.variant_id == variant.id:
+                return installment
+        return None
+
+    @property
+    def discounted_uzs(self):
+        prices = getattr(self, '_prices', None)
+        if prices is not None:
+            return prices.discounted_uzs
+        return self.discount_price
+
     @property
     def monthly_uzs(self):
-        active_variant = Variant.objects.filter(product_type=self.product_type).earliest('percent')
+        prices = getattr(self, '_prices', None)
+        if prices is not None:
+            return prices.monthly_uzs
+        active_variant = get_cheapest_variant(self.product_type)
         total = self.price_uzs + ((active_variant.percent * self.price_uzs) / 100)
         monthly = total / active_variant.duration
         return int(monthly)  # f"%s%s" % (intcomma(int(discount)), ("%0.2f" % discount)[-3:])
 
     @property
     def total_uzs(self):
-        active_variant = Variant.objects.last().percent
+        prices = getattr(self, '_prices', None)
+        if prices is not None:
+            return prices.total_uzs
+        active_variant = get_last_variant().percent
         total = self.price_uzs + ((active_variant * self.price_uzs) / 100)
         return int(total)  # f"%s%s" % (intcomma(int(discount)), ("%0.2f" % discount)[-3:])
 
@@ -273,16 +412,12 @@ class ProductImage(BaseAbstractDate):
 
     @property
     def price_uzs(self):
-        if self.product.product_type != 'product':
-            price = int(self.price * Currency.objects.get(id=2).amount)
-        else:
-            price = int(self.price * Currency.objects.last().amount)
+        price = int(self.price * get_currency_amount(self.product.product_type))
         return price  # "%s%s" % (intcomma(int(price)), ("%0.2f" % price)[-3:])
 
     @property
     def total_uzs(self):
-        variants = Variant.objects.filter(product_type=self.product.product_type).order_by('duration')
-        active_variant = variants.last()
+        active_variant = get_longest_variant(self.product.product_type)
         total = self.price_uzs + ((active_variant.percent * self.price_uzs) / 100)
         return int(total)  # f"%s%s" % (intcomma(int(discount)), ("%0.2f" % discount)[-3:])
 
@@ -291,6 +426,34 @@ class ProductImage(BaseAbstractDate):
         return self.image.url
 
 
+class ProductInstallment(BaseAbstractDate):
+    """Installment plan of a product for one Variant, refreshed by the pricing jobs."""
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='installments')
+    variant = models.ForeignKey(Variant, on_delete=models.CASCADE, related_name='installments')
+    total = models.IntegerField(default=0)
+    monthly = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('product', 'variant')
+
+    def __str__(self):
+        return f'{self.product_id} / {self.variant_id}'
+
+
+class RelatedProduct(models.Model):
+    """One of the top related products of a product, precomputed by the rebuild_related_products command."""
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='related_entries')
+    related = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='related_to')
+    position = models.PositiveSmallIntegerField()
+    score = models.FloatField(default=0)
+
+    class Meta:
+        unique_together = ('product', 'position')
+
+    def __str__(self):
+        return f'{self.product_id} -> {self.related_id}'
+
+
 class AdditionalInfo(BaseAbstractDate):
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='additional_info')
     title = models.CharField(max_length=255)
@@ -322,30 +485,178 @@ class Rate(BaseAbstractDate):
         return round(self.rate * 100 / 5, 1)
 
 
+def shift_product_rate(product_id, rate_delta, count_delta):
+    """Apply a rating change to the product aggregates in a single UPDATE."""
+    Product.objects.filter(pk=product_id).update(
+        rate_sum=F('rate_sum') + rate_delta,
+        rate_count=F('rate_count') + count_delta,
+        rate_avg=Coalesce(
+            Cast(F('rate_sum') + rate_delta, FloatField()) / NullIf(F('rate_count') + count_delta, 0),
+            Value(0.0), output_field=FloatField()
+        ),
+    )
 
-    
+
+@receiver(pre_save, sender=Rate)
+def remember_old_rate(sender, instance, **kwargs):
+    instance._old_rate = None
+    if instance.pk:
+        instance._old_rate = Rate.objects.filter(pk=instance.pk).values_list('product_id', 'rate').first()
+
+
+@receiver(post_save, sender=Rate)
+def update_product_rate(sender, instance, created, **kwargs):
+    old = getattr(instance, '_old_rate', None)
+    rate = int(instance.rate)
+    if old is None:
+        shift_product_rate(instance.product_id, rate, 1)
+    elif old[0] != instance.product_id:
+        shift_product_rate(old[0], -old[1], -1)
+        shift_product_rate(instance.product_id, rate, 1)
+    elif old[1] != rate:
+        shift_product_rate(instance.product_id, rate - old[1], 0)
+
+
+@receiver(post_delete, sender=Rate)
+def delete_product_rate(sender, instance, **kwargs):
+    shift_product_rate(instance.product_id, -int(instance.rate), -1)
+
+
+@receiver(post_save, sender=Currency)
+@receiver(post_delete, sender=Currency)
+def invalidate_currencies(sender, **kwargs):
+    transaction.on_commit(currencies_cache.invalidate)
 
 
+@receiver(post_save, sender=Currency)
+@receiver(post_delete, sender=Currency)
+def reprice_on_currency_change(sender, instance, **kwargs):
+    # only the products priced with this currency, in a background thread rather than the request
+    from apps.product.pricing import mark_for_reprice
+    groups = []
+    if not Currency.objects.filter(id__gt=instance.id).exists():
+        groups.append('product')
+    if instance.id == 2:
+        groups.append('book')
+    transaction.on_commit(lambda: mark_for_reprice(groups))
+
+
+@receiver(pre_save, sender=Variant)
+def remember_old_variant_type(sender, instance, **kwargs):
+    instance._old_product_type = None
+    if instance.pk:
+        instance._old_product_type = Variant.objects.filter(pk=instance.pk).values_list('product_type', flat=True).first()
+
+
+@receiver(post_save, sender=Variant)
+@receiver(post_delete, sender=Variant)
+def refresh_installments_on_variant_change(sender, instance, **kwargs):
+    # only the products of the variant's type (old and new), in the background like currency changes
+    from apps.product.pricing import mark_for_installments
+    product_types = {instance.product_type, getattr(instance, '_old_product_type', None)} - {None}
+    transaction.on_commit(lambda: mark_for_installments(product_types))
+
+
+@receiver(pre_save, sender=ProductImage)
+def remember_old_image(sender, instance, **kwargs):
+    instance._old_image = None
+    if instance.pk:
+        instance._old_image = ProductImage.objects.filter(pk=instance.pk).values_list('product_id', 'price').first()
+
 
 @receiver(post_save, sender=ProductImage)
 def set_uzs_price(sender, instance, **kwargs):
-    if instance.price_uzs:
-        instance.product.uzs_price = instance.product.price_uzs
-        instance.product.save()
+    from apps.product.pricing import dirty_products
+    old = getattr(instance, '_old_image', None)
+    if old is not None and old == (instance.product_id, instance.price):
+        return
+    for product_id in {instance.product_id, old and old[0]}:
+        if product_id:
+            dirty_products.add(product_id)
 
 @receiver(post_delete,sender = ProductImage)
 def delete_image(sender,instance,**kwargs):
-    instance.product.save()
+    from apps.product.pricing import dirty_products
+    if instance.product_id:
+        dirty_products.add(instance.product_id)
+
+
+# the fields the stored prices and the search document of a product are computed from
+PRICE_FIELDS = ('percentage', 'discount', 'product_type')
+SEARCH_FIELDS = ('title_uz', 'title_ru', 'description_uz', 'description_ru', 'status', 'brand_id', 'author_id')
 
 
 @receiver(pre_save, sender=Product)
+def remember_old_product(sender, instance, **kwargs):
+    instance._old_product = None
+    if instance.pk:
+        instance._old_product = Product.objects.filter(pk=instance.pk).values(*PRICE_FIELDS, *SEARCH_FIELDS).first()
+
+
+def product_changed(instance, fields):
+    old = getattr(instance, '_old_product', None)
+    return old is None or any(old[field] != getattr(instance, field) for field in fields)
+
+
+@receiver(post_save, sender=Product)
 def set_uzs_prices(sender, instance, **kwargs):
-    try:
-        if instance.product_images.exists():
-            instance.uzs_price = instance.price_uzs
-        else:
-            instance.uzs_price = 0
-    except:
-        pass
+    from apps.product.pricing import dirty_products
+    if product_changed(instance, PRICE_FIELDS):
+        dirty_products.add(instance.id)
+
+
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, **kwargs):
+    from apps.product.search import index_products
+    if product_changed(instance, SEARCH_FIELDS):
+        index_products(Product.objects.filter(id=instance.id))
+
+
+@receiver(m2m_changed, sender=Product.category.through)
+def index_product_categories(sender, instance, action, pk_set, **kwargs):
+    from apps.product.search import index_products
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if isinstance(instance, Product):
+        index_products(Product.objects.filter(id=instance.id))
+    else:
+        index_products(Product.objects.filter(id__in=pk_set or ()))
+
+
+@receiver(post_save, sender=Brand)
+@receiver(post_save, sender=Author)
+@receiver(post_save, sender=Category)
+def index_related_products(sender, instance, created, **kwargs):
+    from apps.product.search import index_products
+    if not created:
+        lookup = {Brand: 'brand', Author: 'author', Category: 'category'}[sender]
+        index_products(Product.objects.filter(**{lookup: instance}))
+
+
+def record_suggest_change(sender, instance, **kwargs):
+    from apps.product.suggest import record_change
+    kind = {Product: 'product', Brand: 'brand', Author: 'author', Category: 'category'}[sender]
+    object_id = instance.id
+    transaction.on_commit(lambda: record_change(kind, object_id))
+
+
+for suggest_model in (Product, Brand, Author, Category):
+    post_save.connect(record_suggest_change, sender=suggest_model, dispatch_uid=f'suggest_{suggest_model.__name__}')
+    post_delete.connect(record_suggest_change, sender=suggest_model, dispatch_uid=f'suggest_{suggest_model.__name__}')
+
+
+def invalidate_catalog(sender, **kwargs):
+    # the stored prices are rewritten later (after a Currency change, in the background);
+    # reprice_products bumps the version again once they are stored
+    transaction.on_commit(lambda: bump_version(CATALOG_VERSION))
+
+
+for catalog_model in (Product, ProductImage, Category, Banner, Advertisement, BannerDiscount, Rate, Currency, Variant):
+    post_save.connect(invalidate_catalog, sender=catalog_model, dispatch_uid=f'invalidate_catalog_{catalog_model.__name__}')
+    post_delete.connect(invalidate_catalog, sender=catalog_model, dispatch_uid=f'invalidate_catalog_{catalog_model.__name__}')
 
 
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_categories(sender, **kwargs):
+    transaction.on_commit(lambda: bump_version(CATEGORY_VERSION))
@@ -0,0 +1,274 @@
+import threading
+
+import numpy as np
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Case, F, FloatField, IntegerField, Max, Min, OuterRef, Subquery, Value, When
+from django.db.models.functions import Cast, Coalesce, Floor
+
+from apps.base.cache import bump_version
+from apps.base.jobs import BackgroundJob
+from apps.base.models import get_variants, get_last_variant
+from apps.product.models import CATALOG_VERSION, PRODUCT_TYPE, Product, ProductImage, ProductInstallment, get_currency
+
+
+class ProductPrices:
+    """Precomputed UZS prices of one product, attached as ``product._prices`` by PricingEngine."""
+
+    def __init__(self, price, price_uzs, discount_uzs, discounted_uzs, monthly_uzs, total_uzs, plans):
+        self.price = price
+        self.price_uzs = price_uzs
+        self.discount_uzs = discount_uzs
+        self.discounted_uzs = discounted_uzs
+        self.monthly_uzs = monthly_uzs
+        self.total_uzs = total_uzs
+        self.plans = plans
+
+
+class PricingEngine:
+    """
+    Computes every UZS price of a batch of products in one pass.
+    The first image price of each product is read with a single query (or from
+    prefetched ``product_images``), currencies and variants come from the reference
+    cache and all the arithmetic is done on NumPy arrays.
+    """
+
+    def __init__(self):
+        self.variants = get_variants()
+        self.last_variant = get_last_variant()
+
+    def _first_image_prices(self, products):
+        prices = {}
+        missing = []
+        for product in products:
+            cache = getattr(product, '_prefetched_objects_cache', {})
+            if 'product_images' in cache:
+                images = sorted(cache['product_images'], key=lambda image: image.id)
+                prices[product.id] = images[0].price if images else np.nan
+            else:
+                missing.append(product.id)
+        if missing:
+            rows = ProductImage.objects.filter(product_id__in=missing).order_by('product_id', 'id') \
+                .values_list('product_id', 'price')
+            for product_id, price in rows:
+                prices.setdefault(product_id, price)
+        return prices
+
+    @staticmethod
+    def _rates(product_types):
+        rates = {}
+        for product_type in set(product_types):
+            currency = get_currency(product_type)
+            rates[product_type] = currency.amount if currency is not None else np.nan
+        return np.array([rates[product_type] for product_type in product_types], dtype=float)
+
+    def compute(self, products):
+        """Return ``{product.id: ProductPrices}`` for the given products."""
+        products = list(products)
+        if not products:
+            return {}
+        first_prices = self._first_image_prices(products)
+        product_types = [product.product_type for product in products]
+
+        price = np.array([first_prices.get(product.id, np.nan) for product in products], dtype=float)
+        discount = np.array([product.discount or 0 for product in products], dtype=float)
+        percentage = np.array([product.percentage or 0 for product in products], dtype=float)
+        rate = self._rates(product_types)
+
+        price_uzs = np.nan_to_num(np.trunc(price * rate)).astype(np.int64)
+        discount_uzs = np.nan_to_num(np.trunc(discount * rate)).astype(np.int64)
+        discounted_uzs = np.where(percentage > 0, np.trunc(price_uzs - price_uzs * (percentage / 100)), 0).astype(np.int64)
+
+        # products x variants matrix of installment totals and monthly payments
+        percents = np.array([variant.percent for variant in self.variants], dtype=float)
+        durations = np.array([variant.duration for variant in self.variants], dtype=float)
+        totals = price_uzs[:, None] + (percents[None, :] * price_uzs[:, None]) / 100
+        monthlies = np.trunc(totals / durations[None, :]).astype(np.int64)
+        totals = np.trunc(totals).astype(np.int64)
+        same_type = np.array([[variant.product_type == product_type for variant in self.variants]
+                              for product_type in product_types], dtype=bool).reshape(len(products), len(self.variants))
+        # the cheapest plan (lowest percent) of the product type is the advertised monthly payment
+        cheapest = np.where(same_type, percents[None, :], np.inf)
+        cheapest_index = np.argmin(cheapest, axis=1) if self.variants else np.zeros(len(products), dtype=int)
+        has_plan = same_type.any(axis=1)
+
+        last_percent = self.last_variant.percent if self.last_variant else 0
+        total_uzs = np.trunc(price_uzs + (last_percent * price_uzs) / 100).astype(np.int64)
+
+        result = {}
+        for index, product in enumerate(products):
+            plans = [
+                {'variant': variant, 'total': int(totals[index, column]), 'monthly': int(monthlies[index, column])}
+                for column, variant in enumerate(self.variants) if same_type[index, column]
+            ]
+            result[product.id] = ProductPrices(
+                price=None if np.isnan(price[index]) else float(price[index]),
+                price_uzs=int(price_uzs[index]),
+                discount_uzs=int(discount_uzs[index]),
+                discounted_uzs=int(discounted_uzs[index]),
+                monthly_uzs=int(monthlies[index, cheapest_index[index]]) if has_plan[index] else 0,
+                total_uzs=int(total_uzs[index]),
+                plans=plans,
+            )
+        return result
+
+    def apply(self, products):
+        """Attach the precomputed prices to each product as ``_prices`` and return the products as a list."""
+        products = list(products)
+        prices = self.compute(products)
+        for product in products:
+            product._prices = prices[product.id]
+        return products
+
+
+def price_products(products):
+    return PricingEngine().apply(products)
+
+
+def reprice_products(queryset=None, chunk_size=5000, progress=None):
+    """
+    Recompute the stored ``uzs_price``, ``discount`` and ``discount_price`` with set-based
+    UPDATEs, one id range at a time, so the price filters see the current exchange rate
+    without saving every product. The installment plans of each chunk are refreshed too.
+    ``progress(done, total)`` is called after each chunk.
+    """
+    if queryset is None:
+        queryset = Product.objects.all()
+    bounds = queryset.aggregate(low=Min('id'), high=Max('id'))
+    if bounds['low'] is None:
+        return 0
+    total = queryset.count()
+    first_price = Subquery(ProductImage.objects.filter(product=OuterRef('pk')).order_by('id').values('price')[:1])
+
+    discount = first_price - first_price * F('percentage') / 100
+
+    def prices(product_type):
+        currency = get_currency(product_type)
+        amount = Value(currency.amount if currency is not None else 0, output_field=FloatField())
+        uzs_price = Floor(first_price * amount)
+        return {
+            'uzs_price': Coalesce(Cast(uzs_price, IntegerField()), Value(0)),
+            # without a percentage the discount is left as it was entered
+            'discount': Case(When(percentage__gt=0, then=Coalesce(discount, Value(0.0))), default=F('discount'),
+                             output_field=FloatField()),
+            'discount_price': Case(
+                When(percentage__gt=0, then=Coalesce(
+                    Cast(Floor(uzs_price - uzs_price * F('percentage') / 100), IntegerField()), Value(0))),
+                default=Value(0), output_field=IntegerField()),
+        }
+
+    done = 0
+    for start in range(bounds['low'], bounds['high'] + 1, chunk_size):
+        chunk = queryset.filter(id__gte=start, id__lt=start + chunk_size)
+        done += chunk.filter(product_type='product').update(**prices('product'))
+        done += chunk.exclude(product_type='product').update(**prices('book'))
+        refresh_installments(chunk)
+        if progress is not None:
+            progress(done, total)
+    # the UPDATEs send no signals; the cached listings and price bounds follow the new prices
+    transaction.on_commit(lambda: bump_version(CATALOG_VERSION))
+    return done
+
+
+REPRICE_KEY = 'reprice:%s'
+INSTALLMENTS_KEY = 'installments:%s'
+# stored prices come from two currencies: the latest one for appliances ('product')
+# and the row id=2 for every other product type ('book'), see get_currency
+CURRENCY_GROUPS = ('product', 'book')
+
+
+def currency_products(group):
+    """The products priced with the currency of ``group``."""
+    if group == 'product':
+        return Product.objects.filter(product_type='product')
+    return Product.objects.exclude(product_type='product')
+
+
+def mark_for_reprice(groups):
+    """
+    Flag the currency groups whose stored prices are stale and reprice them in the background
+    of this worker, within seconds. A flag left by a worker that exited mid-run is picked up
+    by the next change or by ``manage.py reprice_products --pending``.
+    """
+    for group in groups:
+        cache.set(REPRICE_KEY % group, True, None)
+    background_reprice.start()
+
+
+def mark_for_installments(product_types):
+    """Flag the product types whose variants changed and refresh their installments in the background."""
+    for product_type in product_types:
+        cache.set(INSTALLMENTS_KEY % product_type, True, None)
+    background_reprice.start()
+
+
+def reprice_pending(**kwargs):
+    """
+    Reprice the products of every flagged currency group, then refresh the installments of
+    every flagged product type. A flag is dropped before its products are processed, so a
+    change saved in the meantime is picked up by the next run.
+    """
+    done = 0
+    for group in CURRENCY_GROUPS:
+        if cache.get(REPRICE_KEY % group):
+            cache.delete(REPRICE_KEY % group)
+            done += reprice_products(currency_products(group), **kwargs)
+    for product_type, _ in PRODUCT_TYPE:
+        if cache.get(INSTALLMENTS_KEY % product_type):
+            cache.delete(INSTALLMENTS_KEY % product_type)
+            refresh_installments(Product.objects.filter(product_type=product_type))
+    return done
+
+
+background_reprice = BackgroundJob(reprice_pending, 'reprice')
+
+
+def refresh_installments(queryset=None, chunk_size=5000):
+    """Rebuild the ProductInstallment rows (product x variant of its type) of the given products."""
+    if queryset is None:
+        queryset = Product.objects.all()
+    queryset = queryset.only('id', 'product_type', 'percentage', 'discount').order_by('id')
+    engine = PricingEngine()
+    refreshed = 0
+    for start in range(0, queryset.count(), chunk_size):
+        products = list(queryset[start:start + chunk_size])
+        installments = [
+            ProductInstallment(product_id=product_id, variant=plan['variant'], total=plan['total'],
+                               monthly=plan['monthly'])
+            for product_id, prices in engine.compute(products).items() for plan in prices.plans
+        ]
+        with transaction.atomic():
+            ProductInstallment.objects.filter(product__in=[product.id for product in products]).delete()
+            ProductInstallment.objects.bulk_create(installments, batch_size=1000)
+        refreshed += len(installments)
+    return refreshed
+
+
+class DirtyProducts:
+    """
+    Collects the products touched by image and product saves in the current transaction
+    and reprices each of them once when it commits (immediately in autocommit mode).
+    Every add() registers its own on_commit callback; the first one to run reprices all the
+    products collected so far and the others find nothing left. The ids of a rolled back
+    savepoint stay collected and are simply repriced with the next batch.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def _ids(self):
+        if not hasattr(self._local, 'ids'):
+            self._local.ids = set()
+        return self._local.ids
+
+    def add(self, product_id):
+        self._ids().add(product_id)
+        transaction.on_commit(self.flush)
+
+    def flush(self):
+        ids, self._local.ids = self._ids(), set()
+        if ids:
+            reprice_products(Product.objects.filter(id__in=ids))
+
+
+dirty_products = DirtyProducts()
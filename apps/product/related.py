@@ -0,0 +1,90 @@
+import bisect
+
+from django.db import transaction
+
+from apps.product.models import Product, RelatedProduct
+
+# related products stored per product
+RELATED_LIMIT = 8
+# candidates taken from each category, brand and author: the products closest in price
+CANDIDATE_WINDOW = 50
+
+CATEGORY_WEIGHT = 3
+BRAND_WEIGHT = 2
+AUTHOR_WEIGHT = 2
+PRICE_WEIGHT = 1
+
+
+class RelatedIndex:
+    """
+    Scores active products against each other: every shared category, the same brand and
+    the same author add to the score, and the closer the prices the more it adds. Only the
+    CANDIDATE_WINDOW products nearest in price within each shared group are considered, so
+    a large category costs the same per product as a small one.
+    """
+
+    def __init__(self, rows, categories):
+        self.products = {}
+        groups = {}
+        for product_id, product_type, brand_id, author_id, price in rows:
+            keys = [('category', category_id) for category_id in categories.get(product_id, ())]
+            if brand_id is not None:
+                keys.append(('brand', brand_id))
+            if author_id is not None:
+                keys.append(('author', author_id))
+            self.products[product_id] = (product_type, price or 0, keys)
+            for key in keys:
+                groups.setdefault(key, []).append((price or 0, product_id))
+        self.groups = {key: sorted(members) for key, members in groups.items()}
+        self.weights = {'category': CATEGORY_WEIGHT, 'brand': BRAND_WEIGHT, 'author': AUTHOR_WEIGHT}
+
+    def related(self, product_id, limit=RELATED_LIMIT):
+        """``[(related_id, score)]`` of a product, best first."""
+        product_type, price, keys = self.products[product_id]
+        scores = {}
+        for key in keys:
+            members = self.groups[key]
+            start = bisect.bisect_left(members, (price, product_id))
+            low, high = max(0, start - CANDIDATE_WINDOW // 2), start + CANDIDATE_WINDOW // 2 + 1
+            for _, other_id in members[low:high]:
+                if other_id != product_id and self.products[other_id][0] == product_type:
+                    scores[other_id] = scores.get(other_id, 0) + self.weights[key[0]]
+        for other_id in scores:
+            other_price = self.products[other_id][1]
+            highest = max(price, other_price)
+            if highest:
+                scores[other_id] += PRICE_WEIGHT * min(price, other_price) / highest
+        best = sorted(scores, key=lambda other_id: (-scores[other_id], other_id))[:limit]
+        return [(other_id, scores[other_id]) for other_id in best]
+
+
+def rebuild_related(limit=RELATED_LIMIT, chunk_size=1000):
+    """Recompute the RelatedProduct rows of every product; returns the number of rows written."""
+    active = Product.objects.filter(is_active=True)
+    rows = active.values_list('id', 'product_type', 'brand_id', 'author_id', 'uzs_price')
+    categories = {}
+    for product_id, category_id in Product.category.through.objects.filter(product__is_active=True) \
+            .values_list('product_id', 'category_id'):
+        categories.setdefault(product_id, []).append(category_id)
+    index = RelatedIndex(rows, categories)
+    product_ids = sorted(index.products)
+    written = 0
+    for start in range(0, len(product_ids), chunk_size):
+        chunk = product_ids[start:start + chunk_size]
+        entries = [
+            RelatedProduct(product_id=product_id, related_id=related_id, position=position, score=score)
+            for product_id in chunk
+            for position, (related_id, score) in enumerate(index.related(product_id, limit))
+        ]
+        with transaction.atomic():
+            RelatedProduct.objects.filter(product__in=chunk).delete()
+            RelatedProduct.objects.bulk_create(entries, batch_size=1000)
+        written += len(entries)
+    RelatedProduct.objects.exclude(product__in=active.values('id')).delete()
+    return written
+
+
+def related_products(product, limit=4):
+    """The precomputed related products of ``product`` that are still active, best first."""
+    return Product.objects.filter(related_to__product_id=product.id, is_active=True) \
+        .order_by('related_to__position')[:limit]
@@ -0,0 +1,221 @@
+import re
+
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector, TrigramWordSimilarity
+from django.db import connection
+from django.db.models import Case, F, FloatField, Value, When
+from django.db.models.expressions import RawSQL
+from django.utils.html import strip_tags
+
+from apps.base.cache import ProcessCache
+from apps.product.models import CATALOG_VERSION, Product
+
+FTS_TABLE = 'product_search'
+
+# triggers keeping the SQLite FTS5 table in sync with product_product (created by migration 0016). SQLite
+# drops them whenever a migration rebuilds product_product, and the FTS index then silently
+# stops following the products: rebuild_search_index reinstalls them (see install_fts_triggers)
+FTS_TRIGGERS = [
+    f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON product_product BEGIN "
+    f"INSERT INTO {FTS_TABLE}(rowid, search_document) VALUES (new.id, new.search_document); END",
+    f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON product_product BEGIN "
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, search_document) VALUES ('delete', old.id, old.search_document); END",
+    f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF search_document ON product_product BEGIN "
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, search_document) VALUES ('delete', old.id, old.search_document); "
+    f"INSERT INTO {FTS_TABLE}(rowid, search_document) VALUES (new.id, new.search_document); END",
+]
+
+# Uzbek Cyrillic (and Russian) to Uzbek Latin; apostrophes of o‘, g‘ and the tutuq belgisi are dropped
+# so that "ўзбек", "o‘zbek" and "ozbek" all fold to the same key
+SCRIPT_FOLD = str.maketrans({
+    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'е': 'e', 'ё': 'yo', 'ж': 'j', 'з': 'z', 'и': 'i',
+    'й': 'y', 'к': 'k', 'л': 'l', 'м': 'm', 'н': 'n', 'о': 'o', 'п': 'p', 'р': 'r', 'с': 's', 'т': 't',
+    'у': 'u', 'ф': 'f', 'х': 'x', 'ц': 'ts', 'ч': 'ch', 'ш': 'sh', 'щ': 'sh', 'ъ': '', 'ы': 'i', 'ь': '',
+    'э': 'e', 'ю': 'yu', 'я': 'ya', 'ў': 'o', 'қ': 'q', 'ғ': 'g', 'ҳ': 'h',
+    "'": '', '‘': '', '’': '', 'ʻ': '', 'ʼ': '', '`': '',
+})
+
+
+def fold(text):
+    """Lowercase ``text`` and fold it to one script, so queries match in krill, lotin and Russian alike."""
+    return (text or '').lower().translate(SCRIPT_FOLD)
+
+
+# the fuzzy search keeps words at least this similar to a query word (pg_trgm's default threshold)
+FUZZY_THRESHOLD = 0.3
+# at most this many fuzzy matches are ranked on SQLite
+FUZZY_LIMIT = 500
+
+
+def install_fts_triggers():
+    """
+    Recreate the missing FTS5 triggers on SQLite and rebuild the FTS index from
+    ``search_document``; returns whether any trigger was missing. No-op elsewhere.
+    """
+    if connection.vendor != 'sqlite':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT count(*) FROM sqlite_master WHERE type = 'trigger' AND tbl_name = 'product_product' "
+                       "AND name IN (%s, %s, %s)", [f'{FTS_TABLE}_ai', f'{FTS_TABLE}_ad', f'{FTS_TABLE}_au'])
+        missing = cursor.fetchone()[0] < len(FTS_TRIGGERS)
+        if missing:
+            for statement in FTS_TRIGGERS:
+                cursor.execute(statement)
+            cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+    return missing
+
+
+def build_document(product, categories=()):
+    """
+    Searchable text of a product: both title translations, brand, author, categories, status
+    and descriptions, folded to one script.
+    """
+    parts = [
+        product.title_uz, product.title_ru,
+        product.brand and product.brand.title_uz, product.brand and product.brand.title_ru,
+        product.author and product.author.name,
+        product.status,
+        *categories,
+        strip_tags(product.description_uz or ''), strip_tags(product.description_ru or ''),
+    ]
+    return fold(' '.join(' '.join(str(part).split()) for part in parts if part))
+
+
+def build_key(product, categories=()):
+    """Folded title, brand, author and category titles of a product, matched by the fuzzy search."""
+    parts = [
+        product.title_uz, product.title_ru,
+        product.brand and product.brand.title_uz, product.brand and product.brand.title_ru,
+        product.author and product.author.name,
+        *categories,
+    ]
+    return ' '.join(search_terms(' '.join(part for part in parts if part)))
+
+
+def index_products(queryset=None, chunk_size=1000):
+    """Rebuild ``search_document``, ``search_key`` (and ``search_vector`` on PostgreSQL) of the given products."""
+    if queryset is None:
+        queryset = Product.objects.all()
+    queryset = queryset.select_related('brand', 'author').order_by('id')
+    indexed = 0
+    for start in range(0, queryset.count(), chunk_size):
+        products = list(queryset[start:start + chunk_size])
+        categories = {}
+        rows = Product.category.through.objects.filter(product_id__in=[product.id for product in products]) \
+            .values_list('product_id', 'category__title_uz', 'category__title_ru')
+        for product_id, title_uz, title_ru in rows:
+            categories.setdefault(product_id, []).extend([title_uz, title_ru])
+        changed = []
+        for product in products:
+            document = build_document(product, categories.get(product.id, ()))
+            key = build_key(product, categories.get(product.id, ()))
+            if document != product.search_document or key != product.search_key:
+                product.search_document = document
+                product.search_key = key
+                changed.append(product)
+        Product.objects.bulk_update(changed, ['search_document', 'search_key'], batch_size=500)
+        if changed and connection.vendor == 'postgresql':
+            Product.objects.filter(id__in=[product.id for product in changed]) \
+                .update(search_vector=SearchVector('search_document', config='simple'))
+        indexed += len(changed)
+    return indexed
+
+
+def search_terms(query):
+    return re.findall(r'\w+', fold(query))
+
+
+def search_products(queryset, query, fuzzy=False):
+    """
+    Products of ``queryset`` matching every word of ``query`` (as a prefix), best match
+    first, with the score annotated as ``rank``. ``fuzzy`` tolerates typos instead.
+    """
+    terms = search_terms(query)
+    if not terms:
+        return queryset.none()
+    if fuzzy:
+        return fuzzy_search_products(queryset, terms)
+    if connection.vendor == 'postgresql':
+        tsquery = SearchQuery(' & '.join(f'{term}:*' for term in terms), config='simple', search_type='raw')
+        return queryset.filter(search_vector=tsquery) \
+            .annotate(rank=SearchRank(F('search_vector'), tsquery)).order_by('-rank', 'id')
+    if connection.vendor == 'sqlite':
+        match = ' '.join(f'"{term}"*' for term in terms)
+        return queryset.filter(id__in=RawSQL(f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', [match])) \
+            .annotate(rank=RawSQL(
+                f'SELECT -bm25({FTS_TABLE}) FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s '
+                f'AND rowid = product_product.id', [match])).order_by('-rank', 'id')
+    for term in terms:
+        queryset = queryset.filter(search_document__icontains=term)
+    return queryset
+
+
+def search_with_fallback(queryset, query):
+    """The exact search, or the fuzzy one when nothing matches exactly."""
+    products = search_products(queryset, query)
+    if products.exists():
+        return products
+    return search_products(queryset, query, fuzzy=True)
+
+
+def trigrams(word):
+    """Trigrams of a word, padded the way pg_trgm pads them."""
+    padded = f'  {word} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class TrigramIndex:
+    """In-memory trigram index of ``search_key`` words, the fuzzy search of databases without pg_trgm."""
+
+    def __init__(self, rows):
+        self.products = {}
+        self.words = {}
+        for product_id, key in rows:
+            for word in set(key.split()):
+                self.products.setdefault(word, set()).add(product_id)
+        for word in self.products:
+            for trigram in trigrams(word):
+                self.words.setdefault(trigram, set()).add(word)
+
+    def similar_words(self, term):
+        """``{word: similarity}`` of the indexed words at least FUZZY_THRESHOLD similar to ``term``."""
+        term_trigrams = trigrams(term)
+        candidates = set().union(*(self.words.get(trigram, ()) for trigram in term_trigrams))
+        similar = {}
+        for word in candidates:
+            word_trigrams = trigrams(word)
+            similarity = len(term_trigrams & word_trigrams) / len(term_trigrams | word_trigrams)
+            if similarity >= FUZZY_THRESHOLD:
+                similar[word] = similarity
+        return similar
+
+    def search(self, terms):
+        """``{product_id: score}`` of the products with a similar word for every term."""
+        scores = None
+        for term in terms:
+            term_scores = {}
+            for word, similarity in self.similar_words(term).items():
+                for product_id in self.products[word]:
+                    term_scores[product_id] = max(term_scores.get(product_id, 0), similarity)
+            if scores is None:
+                scores = term_scores
+            else:
+                scores = {product_id: score + term_scores[product_id]
+                          for product_id, score in scores.items() if product_id in term_scores}
+        return {product_id: score / len(terms) for product_id, score in (scores or {}).items()}
+
+
+trigram_index = ProcessCache(CATALOG_VERSION, lambda: TrigramIndex(Product.objects.values_list('id', 'search_key')))
+
+
+def fuzzy_search_products(queryset, terms):
+    if connection.vendor == 'postgresql':
+        text = ' '.join(terms)
+        return queryset.filter(search_key__trigram_word_similar=text) \
+            .annotate(rank=TrigramWordSimilarity(text, 'search_key')).order_by('-rank', 'id')
+    scores = trigram_index.get().search(terms)
+    best = sorted(scores, key=lambda product_id: (-scores[product_id], product_id))[:FUZZY_LIMIT]
+    if not best:
+        return queryset.none()
+    rank = Case(*[When(id=product_id, then=Value(scores[product_id])) for product_id in best],
+                output_field=FloatField())
+    return queryset.filter(id__in=best).annotate(rank=rank).order_by('-rank', 'id')
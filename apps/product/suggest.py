@@ -0,0 +1,223 @@
+import bisect
+import itertools
+import os
+import threading
+import time
+import uuid
+
+from django.core.cache import cache
+from django.utils.translation import get_language
+
+from apps.product.models import Author, Brand, Category, Product
+from apps.product.search import search_terms
+
+# every process appends to a change log of its own: WRITERS_KEY holds the writer names,
+# LAST_CHANGE_KEY the number of a writer's latest change and CHANGE_KEY the changes themselves
+WRITERS_KEY = 'suggest:writers'
+LAST_CHANGE_KEY = 'suggest:last:%s'
+CHANGE_KEY = 'suggest:change:%s:%d'
+# a worker this many changes behind rebuilds its index instead of replaying them
+MAX_CHANGES = 1000
+CHANGE_TIMEOUT = 24 * 60 * 60
+# entries scanned per lookup, so a one-letter prefix stays as cheap as a long one
+SCAN_LIMIT = 5000
+
+KINDS = {
+    'product': (Product.objects.filter(is_active=True), ('title_uz', 'title_ru')),
+    'brand': (Brand.objects.all(), ('title_uz', 'title_ru')),
+    'author': (Author.objects.all(), ('name', 'name')),
+    'category': (Category.objects.filter(is_active=True), ('title_uz', 'title_ru')),
+}
+
+
+class ChangeLog:
+    """
+    The change log of this process. Only this process writes its keys, so numbering the
+    changes needs no shared counter (``cache.incr`` is not atomic on the file cache). The
+    name carries the pid, so a forked worker starts a log of its own.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def record(self, kind, object_id):
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self.name = '%d.%s' % (self._pid, uuid.uuid4().hex[:8])
+                self._numbers = itertools.count(1)
+            number = next(self._numbers)
+            cache.set(CHANGE_KEY % (self.name, number), (kind, object_id), CHANGE_TIMEOUT)
+            cache.set(LAST_CHANGE_KEY % self.name, number, CHANGE_TIMEOUT)
+            self._register()
+
+    def _register(self):
+        """
+        Add this log to ``WRITERS_KEY``, dropping the logs silent for ``CHANGE_TIMEOUT``. Checked
+        on every change: a registration lost to a concurrent one is restored by the next change,
+        and the readers then replay the whole log.
+        """
+        writers = cache.get(WRITERS_KEY) or set()
+        if self.name in writers:
+            return
+        alive = cache.get_many([LAST_CHANGE_KEY % name for name in writers])
+        writers = {name for name in writers if LAST_CHANGE_KEY % name in alive}
+        cache.set(WRITERS_KEY, writers | {self.name}, None)
+
+
+change_log = ChangeLog()
+
+
+def record_change(kind, object_id):
+    """Add a changed object to the change log every worker replays into its index."""
+    change_log.record(kind, object_id)
+
+
+class SuggestIndex:
+    """
+    Sorted array of ``(key, kind, id)`` where the keys are the folded titles starting at each
+    of their words, so a prefix lookup is one bisect plus a short scan. ``keys`` remembers the
+    keys of every object, so an update touches only its own entries.
+    """
+
+    def __init__(self):
+        self.entries = []
+        self.keys = {}
+        self.labels = {}
+
+    @classmethod
+    def build(cls):
+        index = cls()
+        for kind in KINDS:
+            index.load(kind)
+        return index
+
+    def _register(self, kind, object_id, label_uz, label_ru):
+        self.labels[kind, object_id] = {'uz': label_uz or label_ru, 'ru': label_ru or label_uz}
+        keys = set()
+        for label in (label_uz, label_ru):
+            words = search_terms(label)
+            keys.update(' '.join(words[i:]) for i in range(len(words)))
+        self.keys[kind, object_id] = keys
+        return keys
+
+    def load(self, kind):
+        """Index every object of ``kind`` with a single sort."""
+        queryset, fields = KINDS[kind]
+        for object_id, label_uz, label_ru in queryset.values_list('id', *fields):
+            keys = self._register(kind, object_id, label_uz, label_ru)
+            self.entries.extend((key, kind, object_id) for key in keys)
+        self.entries.sort()
+
+    def updated(self, changed):
+        """
+        A new index with the objects ``changed`` (``{kind: ids}``) reloaded. This one is left as
+        it is, since other threads may be bisecting its entries meanwhile.
+        """
+        index = SuggestIndex()
+        index.keys = dict(self.keys)
+        index.labels = dict(self.labels)
+        stale = {(kind, object_id) for kind, ids in changed.items() for object_id in ids}
+        for key in stale:
+            index.keys.pop(key, None)
+            index.labels.pop(key, None)
+        entries = [entry for entry in self.entries if entry[1:] not in stale]
+        for kind, ids in changed.items():
+            queryset, fields = KINDS[kind]
+            for object_id, label_uz, label_ru in queryset.filter(id__in=ids).values_list('id', *fields):
+                keys = index._register(kind, object_id, label_uz, label_ru)
+                entries.extend((key, kind, object_id) for key in keys)
+        entries.sort()
+        index.entries = entries
+        return index
+
+    def suggest(self, prefix, limit=5):
+        """``{kind: [{'id', 'title'}]}``, at most ``limit`` per kind, for the objects with a word starting with ``prefix``."""
+        prefix = ' '.join(search_terms(prefix))
+        result = {kind: [] for kind in KINDS}
+        if not prefix:
+            return result
+        language = 'ru' if (get_language() or '').startswith('ru') else 'uz'
+        seen = set()
+        start = bisect.bisect_left(self.entries, (prefix,))
+        for key, kind, object_id in self.entries[start:start + SCAN_LIMIT]:
+            if not key.startswith(prefix):
+                break
+            labels = self.labels.get((kind, object_id))
+            if labels is None or (kind, object_id) in seen or len(result[kind]) >= limit:
+                continue
+            seen.add((kind, object_id))
+            result[kind].append({'id': object_id, 'title': labels[language]})
+        return result
+
+
+class SuggestCache:
+    """
+    The SuggestIndex of this process. Every ``check_interval`` seconds it replays the changes
+    recorded since the last check into a new index, reloading only the changed objects, and
+    swaps it in; a full rebuild happens only when the worker is too far behind or a change has
+    expired. While one thread syncs, the others keep serving the current index.
+    """
+
+    def __init__(self, check_interval=1):
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._index = None
+        self._seen = {}
+        self._checked_at = 0
+
+    def get(self):
+        if self._due() and self._lock.acquire(blocking=self._index is None):
+            try:
+                if self._due():
+                    self._sync()
+            finally:
+                self._lock.release()
+        return self._index
+
+    def clear(self):
+        self._index = None
+        self._seen = {}
+
+    def _due(self):
+        return self._index is None or time.monotonic() - self._checked_at >= self.check_interval
+
+    def _sync(self):
+        writers = cache.get(WRITERS_KEY) or set()
+        lasts = cache.get_many([LAST_CHANGE_KEY % name for name in writers])
+        last = {name: lasts[LAST_CHANGE_KEY % name] for name in writers if LAST_CHANGE_KEY % name in lasts}
+        # a log silent for CHANGE_TIMEOUT expires; that loses nothing unless this worker has not
+        # checked for as long, in which case it rebuilds
+        expired = time.monotonic() - self._checked_at >= CHANGE_TIMEOUT
+        index = None if self._index is None or expired else self._replay(last)
+        self._index = index or SuggestIndex.build()
+        self._seen = last
+        self._checked_at = time.monotonic()
+
+    def _replay(self, last):
+        """The index with the changes since the last check applied, or None when they cannot be."""
+        keys = []
+        for name, number in last.items():
+            seen = self._seen.get(name, 0)
+            if number < seen:
+                return None
+            keys += [CHANGE_KEY % (name, n) for n in range(seen + 1, number + 1)]
+        if len(keys) > MAX_CHANGES:
+            return None
+        changes = cache.get_many(keys)
+        if len(changes) < len(keys):
+            return None
+        if not changes:
+            return self._index
+        changed = {}
+        for kind, object_id in changes.values():
+            changed.setdefault(kind, set()).add(object_id)
+        return self._index.updated(changed)
+
+
+suggest_cache = SuggestCache()
+
+
+def suggest(prefix, limit=5):
+    return suggest_cache.get().suggest(prefix, limit)
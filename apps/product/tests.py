@@ -1,9 +1,34 @@
+import threading
+import time
+from datetime import timedelta
+from io import StringIO
+
 from django.contrib.auth.models import User
-from django.test import TestCase
+from unittest import mock
+
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.core.cache import cache
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 from rest_framework import status
 from rest_framework.test import APIClient
-from apps.product.models import Brand
+from apps.base.cache import bump_version, count_rows
+from apps.base.jobs import BackgroundJob
+from apps.base.models import Variant, variants_cache
+from apps.order.context_processor import cart_renderer, catalog_globals
+from apps.product.models import Author, BannerDiscount, Brand, Category, Color, Product, ProductImage, ProductInstallment, Rate, Currency, currencies_cache, \
+    get_currency_amount, get_catalog_version, CATALOG_VERSION
+from apps.product.categories import category_tree, get_category_tree
+from apps.product.counters import view_counter
+from apps.product.facets import FacetEngine
+from apps.product.gallery import Gallery
+from apps.product.pricing import PricingEngine, background_reprice, refresh_installments, reprice_products
+from apps.product.related import rebuild_related, related_products
+from apps.product.search import search_products, trigram_index
+from apps.product.suggest import ChangeLog, SuggestIndex, suggest_cache
 
 client = APIClient()
 
@@ -49,3 +74,702 @@ class BrandAPITest(TestCase):
             response = self.client.delete(destroy_url)
             self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
             self.assertEqual(Brand.objects.count(), 0)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class CatalogTestCase(TestCase):
+    def setUp(self) -> None:
+        # counts, fragments and version stamps must not leak between tests or into the dev cache
+        cache.clear()
+        # reference data cached by a previous test survives its rollback
+        variants_cache.clear()
+        currencies_cache.clear()
+        trigram_index.clear()
+        suggest_cache.clear()
+        view_counter.clear()
+        catalog_globals.clear()
+        category_tree.clear()
+        # a background thread would not see the test's uncommitted rows; run the job in place
+        background = mock.patch.object(background_reprice, 'start', side_effect=background_reprice.job)
+        background.start()
+        self.addCleanup(background.stop)
+
+
+class ProductRateTest(CatalogTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.product = Product.objects.create(title='book')
+
+    def test_rate_aggregates(self):
+        first = Rate.objects.create(product=self.product, rate=4)
+        Rate.objects.create(product=self.product, rate='5')
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.rate_sum, self.product.rate_count), (9, 2))
+        self.assertEqual(self.product.mid_rate, 4.5)
+
+        first.rate = 2
+        first.save()
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.mid_rate_percent, 70.0)
+
+        first.delete()
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.rate_sum, self.product.rate_count, self.product.rate_avg), (5, 1, 5.0))
+
+    def test_rebuild_rates(self):
+        Rate.objects.create(product=self.product, rate=3)
+        Product.objects.update(rate_sum=0, rate_count=0, rate_avg=0)
+        Product.rebuild_rates()
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.mid_rate, 3.0)
+
+    def test_shop_pages_list_the_best_rated_first(self):
+        # the shop pages used to sort ascending, showing the three worst rated as "top rated"
+        Currency.objects.create(amount=10000)
+        for rate in (1, 5, 3, 4):
+            Rate.objects.create(product=Product.objects.create(title=f'rated {rate}'), rate=rate)
+        for url in ('/shop/', '/techniques/'):
+            top = self.client.get(url).context['top_rate_products']
+            self.assertEqual([product.mid_rate for product in top], [5.0, 4.0, 3.0], url)
+
+
+class CurrencyCacheTest(CatalogTestCase):
+    def test_currency_is_served_from_cache_until_changed(self):
+        currency = Currency.objects.create(amount=12000)
+        self.assertEqual(get_currency_amount(), 12000)
+        with self.assertNumQueries(0):
+            get_currency_amount()
+        with self.captureOnCommitCallbacks(execute=True):
+            currency.amount = 12500
+            currency.save()
+            self.assertEqual(get_currency_amount(), 12000)
+        self.assertEqual(get_currency_amount(), 12500)
+
+
+class PricingEngineTest(CatalogTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        Currency.objects.create(amount=10000)
+        Variant.objects.create(product_type='product', duration=3, percent=10)
+        Variant.objects.create(product_type='product', duration=12, percent=30)
+
+    def create_products(self, count):
+        for i in range(count):
+            product = Product.objects.create(title=f'product {i}', percentage=10, discount=5)
+            ProductImage.objects.create(product=product, image='products/test.png', price=100 + i)
+
+    def test_engine_matches_properties(self):
+        self.create_products(3)
+        for product in Product.objects.all():
+            prices = PricingEngine().compute([product])[product.id]
+            self.assertEqual(prices.price_uzs, product.price_uzs)
+            self.assertEqual(prices.discount_uzs, product.discount_uzs)
+            self.assertEqual(prices.monthly_uzs, product.monthly_uzs)
+            self.assertEqual(prices.total_uzs, product.total_uzs)
+            self.assertEqual([plan['total'] for plan in prices.plans], [int(product.price_uzs * 1.1),
+                                                                        int(product.price_uzs * 1.3)])
+
+    def test_product_list_queries_do_not_grow(self):
+        self.create_products(2)
+        self.client.get('/api/v1/product/?page_size=1000')
+        cache.clear()  # the total is cached for a minute
+        with CaptureQueriesContext(connection) as small:
+            self.client.get('/api/v1/product/?page_size=1000')
+        self.create_products(20)
+        cache.clear()
+        with CaptureQueriesContext(connection) as large:
+            response = self.client.get('/api/v1/product/?page_size=1000')
+        self.assertEqual(response.json()['count'], 22)
+        self.assertEqual(len(small), len(large))
+
+
+class RepriceTest(CatalogTestCase):
+    def test_currency_change_reprices_catalog(self):
+        currency = Currency.objects.create(amount=10000)
+        with self.captureOnCommitCallbacks(execute=True):
+            product = Product.objects.create(title='phone')
+            ProductImage.objects.create(product=product, image='products/test.png', price=12.5)
+            empty = Product.objects.create(title='no images')
+            book = Product.objects.create(title='book', product_type='book')
+            ProductImage.objects.create(product=book, image='products/test.png', price=1)
+        version = get_catalog_version()
+        with mock.patch('apps.product.pricing.reprice_products', wraps=reprice_products) as reprice:
+            with self.captureOnCommitCallbacks(execute=True):
+                currency.amount = 12000
+                currency.save()
+                background_reprice.start.assert_not_called()
+        self.assertEqual(set(reprice.call_args_list[0][0][0]), {product, empty})
+        product.refresh_from_db()
+        empty.refresh_from_db()
+        self.assertEqual(product.uzs_price, 150000)
+        self.assertEqual(empty.uzs_price, 0)
+        self.assertNotEqual(get_catalog_version(), version)
+        with mock.patch('apps.product.pricing.reprice_products') as reprice:
+            call_command('reprice_products', '--pending', stdout=StringIO())
+        reprice.assert_not_called()
+
+    def test_background_job_reruns_for_starts_while_running(self):
+        calls = []
+        running, release = threading.Event(), threading.Event()
+
+        def job():
+            calls.append(len(calls))
+            running.set()
+            release.wait(5)
+
+        background = BackgroundJob(job, 'test')
+        background.start()
+        running.wait(5)
+        background.start()
+        background.start()
+        release.set()
+        for _ in range(100):
+            if background._thread is None:
+                break
+            time.sleep(0.01)
+        self.assertEqual(calls, [0, 1])
+
+    def test_discount_price_is_stored_at_write_time(self):
+        Currency.objects.create(amount=10000)
+        with self.captureOnCommitCallbacks(execute=True):
+            product = Product.objects.create(title='phone', percentage=20)
+            ProductImage.objects.create(product=product, image='products/test.png', price=10)
+        product.refresh_from_db()
+        self.assertEqual((product.discount, product.discount_price), (8, 80000))
+        with self.assertNumQueries(0):
+            self.assertEqual(product.get_discount_price, 8)
+        with self.captureOnCommitCallbacks(execute=True):
+            product.percentage = 0
+            product.discount = 3
+            product.save()
+        product.refresh_from_db()
+        self.assertEqual((product.discount, product.discount_price), (3, 0))
+
+
+class DirtyProductsTest(CatalogTestCase):
+    def test_images_saved_in_one_transaction_reprice_once(self):
+        Currency.objects.create(amount=10000)
+        with mock.patch('apps.product.pricing.reprice_products') as reprice:
+            with self.captureOnCommitCallbacks(execute=True):
+                with transaction.atomic():
+                    product = Product.objects.create(title='shirt', product_type='product')
+                    for price in (3, 4, 5):
+                        ProductImage.objects.create(product=product, image='products/test.png', price=price)
+        self.assertEqual(reprice.call_count, 1)
+        self.assertEqual(list(reprice.call_args[0][0]), [product])
+
+    def test_rolled_back_savepoint_does_not_drop_the_batch(self):
+        with mock.patch('apps.product.pricing.reprice_products') as reprice:
+            with self.captureOnCommitCallbacks(execute=True):
+                with transaction.atomic():
+                    try:
+                        with transaction.atomic():
+                            Product.objects.create(title='discarded')
+                            raise ValueError
+                    except ValueError:
+                        pass
+                    product = Product.objects.create(title='kept')
+        self.assertEqual(reprice.call_count, 1)
+        self.assertEqual(list(reprice.call_args[0][0]), [product])
+
+    def test_only_price_changes_reprice(self):
+        product = Product.objects.create(title='shirt', percentage=10)
+        image = ProductImage.objects.create(product=product, image='products/test.png', price=3)
+        with mock.patch('apps.product.pricing.reprice_products') as reprice, \
+                mock.patch('apps.product.search.index_products') as index:
+            with self.captureOnCommitCallbacks(execute=True):
+                product.view = 5
+                product.save()
+                image.wrapper = 'qattiq'
+                image.save()
+            reprice.assert_not_called()
+            index.assert_not_called()
+            with self.captureOnCommitCallbacks(execute=True):
+                product.percentage = 20
+                product.save()
+                image.price = 4
+                image.save()
+            self.assertEqual(reprice.call_count, 1)
+            index.assert_not_called()
+
+    def test_uzs_price_follows_first_image(self):
+        Currency.objects.create(amount=10000)
+        with self.captureOnCommitCallbacks(execute=True):
+            product = Product.objects.create(title='shirt', product_type='product')
+            ProductImage.objects.create(product=product, image='products/test.png', price=3)
+            ProductImage.objects.create(product=product, image='products/test.png', price=9)
+        product.refresh_from_db()
+        self.assertEqual(product.uzs_price, 30000)
+
+
+class ProductInstallmentTest(CatalogTestCase):
+    def test_installments_follow_prices_and_variants(self):
+        Currency.objects.create(amount=10000)
+        with self.captureOnCommitCallbacks(execute=True):
+            variant = Variant.objects.create(product_type='product', duration=4, percent=20)
+            product = Product.objects.create(title='tv')
+            ProductImage.objects.create(product=product, image='products/test.png', price=10)
+        installment = ProductInstallment.objects.get(product=product, variant=variant)
+        self.assertEqual((installment.total, installment.monthly), (120000, 30000))
+        Product.objects.create(title='book', product_type='book')
+
+        background_reprice.start.reset_mock()
+        with mock.patch('apps.product.pricing.refresh_installments', wraps=refresh_installments) as refresh:
+            with self.captureOnCommitCallbacks(execute=True):
+                variant.percent = 40
+                variant.save()
+                background_reprice.start.assert_not_called()
+        # only the products of the variant's type
+        self.assertEqual(list(refresh.call_args[0][0]), [product])
+        response = self.client.get(f'/api/v1/product/installments/?product={product.id}')
+        self.assertEqual(response.json(), [{'product': product.id, 'variant': variant.id, 'duration': 4,
+                                            'percent': 40, 'total': 140000, 'monthly': 35000}])
+
+    def test_installments_reject_non_numeric_ids(self):
+        response = self.client.get('/api/v1/product/installments/?product=1,abc')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class HomepageCacheTest(CatalogTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        bump_version(CATALOG_VERSION)
+        Currency.objects.create(amount=10000)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product = Product.objects.create(title='kettle', percentage=25)
+            ProductImage.objects.create(product=self.product, image='products/test.png', price=10)
+
+    def test_sections_are_served_from_cache(self):
+        self.client.get('/')
+        with CaptureQueriesContext(connection) as cold:
+            bump_version(CATALOG_VERSION)
+            self.assertContains(self.client.get('/'), 'kettle')
+        with CaptureQueriesContext(connection) as warm:
+            self.assertContains(self.client.get('/'), 'kettle')
+        self.assertLess(len(warm), len(cold))
+        self.assertFalse([query for query in warm if 'product_productimage' in query['sql']])
+
+    def test_catalog_change_invalidates_sections(self):
+        self.client.get('/')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.title = 'toaster'
+            self.product.save()
+        response = self.client.get('/')
+        self.assertContains(response, 'toaster')
+        self.assertNotContains(response, 'kettle')
+
+
+class DiscountFeedTest(CatalogTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        Currency.objects.create(amount=10000)
+        for percentage in (0, 10, 20, 30, 50):
+            Product.objects.create(title=f'{percentage}% off', percentage=percentage, product_type='book')
+        Product.objects.create(title='inactive', percentage=40, is_active=False)
+
+    def test_feed_is_filtered_in_the_database(self):
+        with self.assertNumQueries(1):
+            percentages = sorted(product.percentage for product in Product.discounted())
+        self.assertEqual(percentages, [20, 30, 50])
+
+    def test_discounts_api(self):
+        response = self.client.get('/api/v1/product/discounts/?product_type=book&limit=2')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()), 2)
+        self.assertEqual(set(product['title_uz'] for product in response.json()) - {'20% off', '30% off', '50% off'}, set())
+        self.assertEqual(len(self.client.get('/api/v1/product/discounts/?product_type=product').json()), 0)
+
+
+class FacetEngineTest(CatalogTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.red = Color.objects.create(name='#ff0000', title='red')
+        self.blue = Color.objects.create(name='#0000ff', title='blue')
+        self.uzbek = self.create_book('uzbek', self.red, self.blue)
+        self.russian = self.create_book('russian', self.red)
+        self.english = self.create_book('english', self.blue)
+
+    @staticmethod
+    def create_book(language, *colors):
+        book = Product.objects.create(title=language, product_type='book', language=language)
+        for color in colors:
+            ProductImage.objects.create(product=book, image='products/test.png', price=1, color=color)
+        return book
+
+    def test_and_between_or_within(self):
+        engine = FacetEngine(Product.objects.all(), {'language': ['uzbek', 'russian'], 'color': [self.blue.id]})
+        self.assertEqual(list(engine.filter()), [self.uzbek])
+        engine = FacetEngine(Product.objects.all(), {'color': [self.red.id, self.blue.id]})
+        self.assertEqual(engine.filter().count(), 3)
+
+    def test_counts_ignore_own_selection(self):
+        engine = FacetEngine(Product.objects.all(), {'language': ['uzbek'], 'color': [self.red.id]})
+        with self.assertNumQueries(1):
+            counts = engine.counts(['language', 'color'])
+        self.assertEqual(counts['language'], {'uzbek': 1, 'russian': 1})
+        self.assertEqual(counts['color'], {self.red.id: 1, self.blue.id: 1})
+
+    def test_facets_api(self):
+        response = self.client.get(f'/app/v1/products/facets/?product_type=book&color={self.blue.id}')
+        self.assertEqual(response.json()['language'], {'uzbek': 1, 'english': 1})
+        response = self.client.get(f'/app/v1/products/?language=uzbek&language=english&color={self.red.id}')
+        self.assertEqual([product['id'] for product in response.json()['results']], [self.uzbek.id])
+
+
+class SearchTest(CatalogTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        brand = Brand.objects.create(title='Samsung')
+        self.tv = Product.objects.create(title_uz='Televizor', title_ru='Телевизор', brand=brand,
+                                         description_uz='<p>Katta <b>ekran</b></p>')
+        self.phone = Product.objects.create(title_uz='Telefon', title_ru='Телефон', brand=brand)
+        Product.objects.create(title_uz='Kitob', title_ru='Книга', product_type='book')
+
+    def test_search_is_maintained_on_save(self):
+        self.assertEqual(list(search_products(Product.objects.all(), 'ekran')), [self.tv])
+        self.assertEqual(list(search_products(Product.objects.all(), 'телев')), [self.tv])
+        self.assertEqual(set(search_products(Product.objects.all(), 'samsung')), {self.tv, self.phone})
+        self.phone.brand.title = 'Apple'
+        self.phone.brand.save()
+        self.assertEqual(search_products(Product.objects.all(), 'samsung').count(), 0)
+        self.assertEqual(search_products(Product.objects.all(), 'apple tel').count(), 2)
+
+    def test_ranked_search_api(self):
+        response = self.client.get('/api/v1/product/search/?q=telef')
+        self.assertEqual([product['id'] for product in response.json()['results']], [self.phone.id])
+        response = self.client.get('/api/v1/product/?search=kitob')
+        self.assertEqual(response.json()['count'], 1)
+
+    def test_scripts_are_folded(self):
+        book = Product.objects.create(title_uz='O‘zbek tili darsligi', title_ru='Учебник узбекского языка',
+                                      product_type='book', author=Author.objects.create(name='Шукур Холмирзаев'))
+        for query in ('ўзбек', "o'zbek", 'ozbek', 'uchebnik', 'xolmirzaev', 'Холмирзаев', 'shukur'):
+            self.assertEqual(list(search_products(Product.objects.all(), query)), [book], query)
+
+    def test_rebuild_reinstalls_dropped_triggers(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('FTS5 triggers are SQLite only')
+        with connection.cursor() as cursor:
+            for suffix in ('ai', 'ad', 'au'):
+                cursor.execute(f'DROP TRIGGER product_search_{suffix}')
+        radio = Product.objects.create(title_uz='Radio')
+        self.assertEqual(search_products(Product.objects.all(), 'radio').count(), 0)
+        output = StringIO()
+        call_command('rebuild_search_index', stdout=output)
+        self.assertIn('triggers', output.getvalue())
+        self.assertEqual(list(search_products(Product.objects.all(), 'radio')), [radio])
+        self.assertEqual(list(search_products(Product.objects.all(), 'ekran')), [self.tv])
+
+
+class FuzzySearchTest(CatalogTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.tv = Product.objects.create(title_uz='Televizor', brand=Brand.objects.create(title='Samsung'))
+        self.book = Product.objects.create(title_uz='Kitob', product_type='book',
+                                           author=Author.objects.create(name='Abdulla Qodiriy'))
+
+    def test_misspelled_brand_and_author(self):
+        self.assertEqual(search_products(Product.objects.all(), 'samsng').count(), 0)
+        self.assertEqual(list(search_products(Product.objects.all(), 'samsng', fuzzy=True)), [self.tv])
+        self.assertEqual(list(search_products(Product.objects.all(), 'kodiriy', fuzzy=True)), [self.book])
+        self.assertEqual(search_products(Product.objects.all(), 'samsng kodiriy', fuzzy=True).count(), 0)
+
+    def test_misspelled_category(self):
+        category = Category.objects.create(title_uz='Maishiy texnika', title_ru='Бытовая техника')
+        self.tv.category.add(category)
+        self.assertEqual(list(search_products(Product.objects.all(), 'maishy', fuzzy=True)), [self.tv])
+        self.assertEqual(list(search_products(Product.objects.all(), 'бытавая', fuzzy=True)), [self.tv])
+        category.title_uz = 'Elektronika'
+        with self.captureOnCommitCallbacks(execute=True):
+            category.save()
+        self.assertEqual(search_products(Product.objects.all(), 'maishy', fuzzy=True).count(), 0)
+
+    def test_fuzzy_api_and_storefront_fallback(self):
+        response = self.client.get('/app/v1/products/?search=televizr&fuzzy=1')
+        self.assertEqual([product['id'] for product in response.json()['results']], [self.tv.id])
+        self.assertContains(self.client.get('/shop/?search=samsnug'), 'Televizor')
+
+
+class SuggestTest(CatalogTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        Product.objects.create(title_uz='Samsung Galaxy', title_ru='Самсунг Галакси', brand=Brand.objects.create(
+            title_uz='Samsung', title_ru='Самсунг'))
+
+    def test_suggest_from_memory(self):
+        self.client.get('/api/v1/product/suggest/?q=sam')
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/v1/product/suggest/?q=gal')
+        self.assertEqual([product['title'] for product in response.json()['product']], ['Samsung Galaxy'])
+        self.assertEqual(response.json()['brand'], [])
+        response = self.client.get('/api/v1/product/suggest/?q=самс', HTTP_ACCEPT_LANGUAGE='ru')
+        self.assertEqual(len(response.json()['brand']), 1)
+
+    def test_index_follows_changes(self):
+        self.client.get('/api/v1/product/suggest/?q=sam')
+        with self.captureOnCommitCallbacks(execute=True):
+            phone = Product.objects.create(title_uz='Samsung Note')
+        with mock.patch.object(suggest_cache, 'check_interval', 0):
+            response = self.client.get('/api/v1/product/suggest/?q=samsung')
+            self.assertEqual(len(response.json()['product']), 2)
+            with self.captureOnCommitCallbacks(execute=True):
+                phone.is_active = False
+                phone.save()
+            response = self.client.get('/api/v1/product/suggest/?q=note')
+            self.assertEqual(response.json()['product'], [])
+
+    def test_changes_of_every_worker_are_replayed_into_a_new_index(self):
+        old = suggest_cache.get()
+        entries = list(old.entries)
+        tv = Product.objects.create(title_uz='Samsung TV')
+        brand = Brand.objects.create(title_uz='Sony')
+        ChangeLog().record('product', tv.id)
+        ChangeLog().record('brand', brand.id)
+        with mock.patch.object(suggest_cache, 'check_interval', 0), \
+                mock.patch.object(SuggestIndex, 'build', side_effect=AssertionError('rebuilt')):
+            index = suggest_cache.get()
+        self.assertIsNot(index, old)
+        self.assertEqual(old.entries, entries)
+        self.assertEqual(len(index.suggest('samsung')['product']), 2)
+        self.assertEqual(index.suggest('son')['brand'], [{'id': brand.id, 'title': 'Sony'}])
+
+
+class KeysetPaginationTest(CatalogTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        Currency.objects.create(amount=10000)
+        for i in range(25):
+            product = Product.objects.create(title=f'product {i}')
+            ProductImage.objects.create(product=product, image='products/test.png', price=1)
+
+    def walk(self, url):
+        ids = []
+        while url:
+            data = self.client.get(url).json()
+            ids += [item['id'] for item in data['results']]
+            url = data['next']
+        return ids, data
+
+    def test_cursor_pages_cover_everything_once(self):
+        ids, data = self.walk('/api/v1/product/?cursor=&page_size=10')
+        self.assertEqual(ids, list(Product.objects.order_by('-id').values_list('id', flat=True)))
+        self.assertEqual(data['count'], 25)
+        ids, _ = self.walk('/api/v1/product/?cursor=&page_size=7&ordering=created_at')
+        self.assertEqual(sorted(ids), sorted(Product.objects.values_list('id', flat=True)))
+        self.assertEqual(len(ids), 25)
+
+    def test_deep_cursor_page_does_not_offset(self):
+        first = self.client.get('/api/v1/product/?cursor=&page_size=10').json()
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(first['next'])
+        self.assertFalse([query for query in queries if 'OFFSET' in query['sql'] and 'product_product' in query['sql']])
+
+    def test_images_stay_unpaginated_without_cursor(self):
+        self.assertIsInstance(self.client.get('/api/v1/product/image/').json(), list)
+        data = self.client.get('/api/v1/product/image/?cursor=&page_size=20').json()
+        self.assertEqual(len(data['results']), 20)
+
+
+class CountStrategyTest(CatalogTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        Currency.objects.create(amount=10000)
+        for i in range(25):
+            Product.objects.create(title=f'product {i}')
+
+    def test_count_is_cached_per_filter_set(self):
+        self.assertEqual(count_rows(Product.objects.order_by('id')), (25, False))
+        with self.assertNumQueries(0):
+            self.assertEqual(count_rows(Product.objects.order_by('-created_at')), (25, False))
+        self.assertEqual(count_rows(Product.objects.filter(title='product 1')), (1, False))
+
+    def test_estimate_above_threshold_is_flagged(self):
+        with mock.patch('apps.base.cache.estimate_count', return_value=50000):
+            self.assertEqual(count_rows(Product.objects.all(), estimate_above=10000), (50000, True))
+            self.assertEqual(count_rows(Product.objects.all(), estimate_above=100000), (25, False))
+        with mock.patch('apps.base.cache.estimate_count', return_value=50000), \
+                mock.patch('api.book.helper.CountedPaginator.estimate_above', 10000):
+            data = self.client.get('/api/v1/product/?page_size=10').json()
+        self.assertEqual((data['count'], data['count_approximate'], data['page_count']), (50000, True, 5000))
+        cache.clear()
+        self.assertFalse(self.client.get('/api/v1/product/?cursor=').json()['count_approximate'])
+
+
+class GalleryTest(CatalogTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        Currency.objects.create(amount=10000)
+        Variant.objects.create(product_type='product', duration=12, percent=30)
+        self.red = Color.objects.create(title='red', name='#f00')
+        self.blue = Color.objects.create(title='blue', name='#00f')
+        self.product = Product.objects.create(title='shirt')
+        for color, price in ((self.red, 10), (self.blue, 20), (self.blue, 20)):
+            ProductImage.objects.create(product=self.product, color=color, image='products/test.png', price=price)
+
+    def test_groups_in_one_query(self):
+        with self.assertNumQueries(1):
+            gallery = Gallery(self.product)
+            representatives = gallery.representatives
+            default = gallery.default
+            groups = gallery.as_list(lambda images: [image.id for image in images])
+        self.assertEqual([image.color_id for image in representatives], [self.blue.id, self.red.id])
+        self.assertEqual([image.color_id for image in default], [self.red.id])
+        self.assertEqual([(group['color_title'], group['price'], len(group['images'])) for group in groups],
+                         [('red', 10, 1), ('blue', 20, 2)])
+
+    def test_detail_views(self):
+        self.assertEqual(self.client.get(f'/shop-details/{self.product.id}/').status_code, 200)
+        data = self.client.get(f'/detail/{self.product.id}/').json()['data']
+        self.assertEqual(len(data['colors']), 2)
+        images = self.client.get(f'/api/v1/product/{self.product.id}/images/').json()['all_images']
+        self.assertEqual([group['color_id'] for group in images], [self.red.id, self.blue.id])
+
+
+class ViewCounterTest(CatalogTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        Currency.objects.create(amount=10000)
+        Variant.objects.create(product_type='product', duration=12, percent=30)
+        self.product = Product.objects.create(title='shirt')
+        ProductImage.objects.create(product=self.product, image='products/test.png', price=10)
+
+    def test_detail_page_does_not_write(self):
+        updated_at = self.product.updated_at
+        with CaptureQueriesContext(connection) as queries:
+            for _ in range(3):
+                self.client.get(f'/shop-details/{self.product.id}/')
+        self.assertFalse([query for query in queries if query['sql'].startswith('UPDATE')])
+        with mock.patch('apps.product.models.bump_version') as bump:
+            self.assertEqual(view_counter.flush(), 3)
+        bump.assert_not_called()
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.view, self.product.updated_at), (3, updated_at))
+
+    def test_flush_is_started_in_the_background_once_due(self):
+        with mock.patch.object(view_counter._flusher, 'start') as start:
+            self.client.get(f'/shop-details/{self.product.id}/')
+            start.assert_not_called()
+            with mock.patch.object(view_counter, 'flush_interval', 0):
+                self.client.get(f'/shop-details/{self.product.id}/')
+            start.assert_called_once_with()
+
+
+class RelatedProductsTest(CatalogTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        Currency.objects.create(amount=10000)
+        Variant.objects.create(product_type='product', duration=12, percent=30)
+        self.brand = Brand.objects.create(title='apple')
+        self.phones = Category.objects.create(title='phones')
+        self.product = self.create('iphone', 1000)
+        self.same_brand_far = self.create('iphone pro', 100)
+        self.same_brand_near = self.create('iphone mini', 900)
+        self.category_only = self.create('galaxy', 1000, branded=False)
+        self.unrelated = self.create('case', 1000, branded=False, categorized=False)
+        self.create('old iphone', 1000, is_active=False)
+
+    def create(self, title, price, branded=True, categorized=True, is_active=True):
+        product = Product.objects.create(title=title, uzs_price=price, is_active=is_active,
+                                         brand=self.brand if branded else None)
+        if categorized:
+            product.category.add(self.phones)
+        return product
+
+    def test_rebuild_ranks_by_shared_attributes_and_price(self):
+        rebuild_related()
+        self.assertEqual(list(related_products(self.product, 8)),
+                         [self.same_brand_near, self.same_brand_far, self.category_only])
+        self.assertEqual(list(related_products(self.unrelated, 8)), [])
+
+    def test_detail_reads_precomputed_list(self):
+        rebuild_related()
+        ProductImage.objects.create(product=self.product, image='products/test.png', price=10)
+        footer = self.client.get(f'/detail/{self.product.id}/').json()['footer']
+        self.assertEqual([item['id'] for item in footer],
+                         [self.same_brand_near.id, self.same_brand_far.id, self.category_only.id])
+        self.assertEqual(self.client.get(f'/shop-details/{self.product.id}/').status_code, 200)
+
+
+class ShuffleTest(CatalogTestCase):
+    def test_reshuffle_bumps_catalog_version_on_commit(self):
+        Product.objects.create(title='phone')
+        version = get_catalog_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('shuffle_products', stdout=StringIO())
+            self.assertEqual(get_catalog_version(), version)
+        self.assertNotEqual(get_catalog_version(), version)
+
+
+class BannerDiscountExpiryTest(CatalogTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        now = timezone.now()
+        self.expired = BannerDiscount.objects.create(title='old', deadline=now - timedelta(minutes=1))
+        self.running = BannerDiscount.objects.create(title='new', deadline=now + timedelta(days=1))
+
+    def test_listing_hides_expired_before_the_job_runs(self):
+        self.assertEqual(list(BannerDiscount.running()), [self.running])
+        self.assertTrue(BannerDiscount.objects.get(id=self.expired.id).is_active)
+
+    def test_expire_in_one_update(self):
+        version = get_catalog_version()
+        with self.assertNumQueries(1):
+            self.assertEqual(BannerDiscount.expire(), 1)
+        self.assertEqual(list(BannerDiscount.objects.filter(is_active=True)), [self.running])
+        self.assertNotEqual(get_catalog_version(), version)
+        self.assertEqual(BannerDiscount.expire(), 0)
+
+
+class CartRendererTest(CatalogTestCase):
+    def test_values_are_lazy_and_globals_cached(self):
+        Currency.objects.create(amount=10000)
+        Category.objects.create(title='phones')
+        cheap = Product.objects.create(title='cheap', uzs_price=100)
+        dear = Product.objects.create(title='dear', uzs_price=900)
+        with self.assertNumQueries(0):
+            context = cart_renderer(RequestFactory().get('/'))
+        with self.assertNumQueries(6):  # bounds, their prices and rates, categories
+            self.assertEqual((context['min_price'], context['max_price']), (cheap, dear))
+            self.assertEqual([category.title for category in context['categories']], ['phones'])
+        with self.assertNumQueries(0):
+            context = cart_renderer(RequestFactory().get('/'))
+            self.assertEqual(context['max_price'], dear)
+            context['max_price'].total_uzs
+
+
+class CategoryTreeTest(CatalogTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.books = Category.objects.create(title='books', product_type='book')
+        self.novels = Category.objects.create(title='novels', parent=self.books, product_type='book')
+        self.hidden = Category.objects.create(title='hidden', parent=self.books, is_active=False)
+        Category.objects.create(title='under hidden', parent=self.hidden)
+        self.phones = Category.objects.create(title='phones')
+
+    def test_tree_is_built_in_one_query(self):
+        with self.assertNumQueries(1):
+            tree = get_category_tree()
+            menu = [(root.title, [child.title for child in root.menu_children]) for root in tree.menu]
+        self.assertEqual(menu, [('books', ['novels']), ('phones', [])])
+        self.assertEqual(tree.subcategories, [self.novels])
+        with self.assertNumQueries(0):
+            get_category_tree()
+
+    def test_menu_is_rendered_from_tree(self):
+        content = self.client.get('/about/').content.decode()
+        self.assertIn('novels', content)
+        self.assertNotIn('under hidden', content)
+
+    def test_category_save_rebuilds_tree(self):
+        get_category_tree()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.hidden.is_active = True
+            self.hidden.save()
+        self.assertEqual([child.title for child in get_category_tree().menu[0].menu_children],
+                         ['hidden', 'novels'])
+
+    def test_api_lists_roots_with_children(self):
+        get_category_tree()
+        with self.assertNumQueries(0):
+            data = self.client.get('/api/v1/category/').json()
+        self.assertEqual([(item['title_uz'], len(item['children'])) for item in data], [('phones', 0), ('books', 2)])
@@ -1,23 +1,48 @@
-from django.utils import timezone
-from django.db.models import Q, Min
+from django.db.models import Prefetch, Q, Min
 from django.http import JsonResponse
+from django.utils.functional import SimpleLazyObject, cached_property
 from rest_framework.generics import RetrieveAPIView
 
 from api.product.serializers import VariantSerializer
-from apps.base.models import Variant
+from apps.base.cache import cached_count
+from apps.base.models import get_variants
 from apps.product.api.serializers import AppProductSerializer, ProductRetrieveSerializer
+from apps.product.counters import view_counter
+from apps.product.facets import FacetEngine, attach_counts
 from apps.product.forms import CommentForm
+from apps.product.gallery import Gallery
+from apps.product.pricing import price_products
+from apps.product.related import RELATED_LIMIT, related_products
+from apps.product.search import search_with_fallback
 from django.shortcuts import render, get_object_or_404, redirect
 from apps.product.models import Category, Banner, Brand, Product, Rate, Advertisement, Color, ProductImage, \
-    Currency, BannerDiscount, Author, Size
+    BannerDiscount, Author, Size, get_catalog_version
 from django.core.paginator import Paginator
 from rest_framework.response import Response
 
 
-def range_filter(high, low, products):
-    currency = Currency.objects.last().amount
-    active_variant = Variant.objects.last().percent
+HOME_CACHE_TIMEOUT = 60 * 60
+
+
+def lazy_products(build):
+    """Priced products of a homepage section, queried only if its cached fragment has to be rendered."""
+    return SimpleLazyObject(lambda: price_products(build()))
+
+
+class CachedCountPaginator(Paginator):
+    """Paginator whose total is a short-lived cached COUNT, shared by every page of the same listing."""
+
+    @cached_property
+    def count(self):
+        return cached_count(self.object_list)
 
+
+def price_page(page):
+    page.object_list = price_products(page.object_list)
+    return page
+
+
+def range_filter(high, low, products):
     products = products.filter(
         uzs_price__gte=low, uzs_price__lte=high)
 
@@ -26,17 +51,16 @@ def range_filter(high, low, products):
 
 def index(request):
     advertisements = Advertisement.objects.all().order_by('-id')
-    product = Product.objects.filter(is_active=True).order_by('?')
+    product = Product.objects.filter(is_active=True).order_by('shuffle_key', 'id')
     category = Category.objects.filter(is_active=True)
     brand = Brand.objects.all().order_by('-id')
     banner = Banner.objects.all()
     last_3_products = product.order_by('-created_at')
-    top_rated_products = sorted(product, key=lambda t: t.mid_rate, reverse=True)
+    top_rated_products = product.order_by('-rate_avg')
     top_viewed_products = product.order_by('-view')
-    banner_discounts = BannerDiscount.objects.filter(product__isnull=False, is_active=True)
+    banner_discounts = BannerDiscount.running().filter(product__isnull=False)
 
-    # Generate the query list using list comprehension.
-    query = [qs for qs in product if qs.percentage >= 20]
+    discounts = Product.discounted(product)
 
     # filters
     cat = request.GET.get('cat')
@@ -56,32 +80,28 @@ def index(request):
             product = product.filter(product_type='product')
             status_index = 'product'
     if search:
-        product = product.filter(Q(title__icontains=search) | Q(category__title__icontains=search))
-
-    for banner_discount in banner_discounts:
-        now = timezone.now()
-        deadline = banner_discount.deadline
-        if now >= deadline:
-            banner_discount.is_active = False
-            banner_discount.save()
+        product = search_with_fallback(product, search)
 
     context = {
         'advertisements': advertisements[:1],
         'last_advertisements': advertisements[1:2],
-        'discounts': query[2:3],
-        'queryset': query[:2],
+        'discounts': lazy_products(lambda: discounts[2:3]),
+        'queryset': lazy_products(lambda: discounts[:2]),
 
-        'products': product[:20],
-        'objects': product[21:41],
-        'second_objects': product[42:62],
+        'products': lazy_products(lambda: product[:20]),
+        'objects': lazy_products(lambda: product[21:41]),
+        'second_objects': lazy_products(lambda: product[42:62]),
         'categories': category,
         'brands': brand,
         'banners': banner[:5],
-        'last_products': last_3_products,
-        'top_rate_products': top_rated_products,
-        'top_viewed_products': top_viewed_products,
+        'last_products': lazy_products(lambda: last_3_products[:3]),
+        'top_rate_products': lazy_products(lambda: top_rated_products[:3]),
+        'top_viewed_products': lazy_products(lambda: top_viewed_products[:3]),
         'status_index': status_index,
         'banner_discounts': banner_discounts[:1],
+        'catalog_version': get_catalog_version(),
+        'home_cache_timeout': HOME_CACHE_TIMEOUT,
+        'home_query': request.GET.urlencode(),
     }
     return render(request, 'index.html', context)
 
@@ -91,10 +111,10 @@ def about(request):
 
 
 def shop_list(request):
-    products = Product.objects.filter(is_active=True).order_by('?')
+    products = Product.objects.filter(is_active=True).order_by('shuffle_key', 'id')
     category = Category.objects.filter(is_active=True)
     brands = Brand.objects.all().order_by('-id')
-    top_rate_products = sorted(products, key=lambda t: t.mid_rate)
+    top_rate_products = products.order_by('-rate_avg')
     last_3_products = products.order_by('-view')
 
     # filter
@@ -111,9 +131,7 @@ def shop_list(request):
         active_cat_name = cat
         products = products.filter(category__title__icontains=cat)
     if search:
-        products = products.filter(
-            Q(title__icontains=search) | Q(status__contains=search) | Q(brand__title__icontains=search) | Q(
-                description=search))
+        products = search_with_fallback(products, search)
     if advertisement:
         products = products.filter(advertisement__title__contains=advertisement)
     if brand:
@@ -123,15 +141,15 @@ def shop_list(request):
 
     # paginator
     page_number = request.GET.get('page')
-    paginator = Paginator(products, 20)
-    paginated_products = paginator.get_page(page_number)
+    paginator = CachedCountPaginator(products, 20)
+    paginated_products = price_page(paginator.get_page(page_number))
 
-    # Generate the query list using list comprehension.
-    query = [qs for qs in products if qs.percentage >= 20]
+    # the templates show a single discounted product
+    discounts = Product.discounted(products)[:1]
 
     context = {
         'products': paginated_products,
-        'discounts': query,
+        'discounts': price_products(discounts),
         'page_obj': paginated_products,
         'cats': category,
         'active_cat': active_cat,
@@ -139,17 +157,17 @@ def shop_list(request):
         'active_brand': active_brand,
         'active_brand_name': active_brand_name,
         'brands': brands,
-        'last_3_products': last_3_products[:3],
-        'top_rate_products': top_rate_products
+        'last_3_products': price_products(last_3_products[:3]),
+        'top_rate_products': price_products(top_rate_products[:3])
     }
     return render(request, 'shop.html', context)
 
 
 def shop_appliances(request):
-    products = Product.objects.filter(is_active=True, product_type='product').order_by('?')
+    products = Product.objects.filter(is_active=True, product_type='product').order_by('shuffle_key', 'id')
     category = Category.objects.filter(is_active=True, product_type='product')
     brands = Brand.objects.filter(product_type='product').order_by('-id')
-    top_rate_products = sorted(products, key=lambda t: t.mid_rate)
+    top_rate_products = products.order_by('-rate_avg')
     last_3_products = products.order_by('-view')
 
     # filter
@@ -179,20 +197,17 @@ def shop_appliances(request):
         )
 
     if search_name:
-        products = products.filter(
-            Q(title__icontains=search_name) | Q(status__contains=search_name) | Q(
-                brand__title__icontains=search_name) | Q(
-                description=search_name))
+        products = search_with_fallback(products, search_name)
 
-    paginator = Paginator(products, 20)
-    paginated_products = paginator.get_page(page_number)
+    paginator = CachedCountPaginator(products, 20)
+    paginated_products = price_page(paginator.get_page(page_number))
 
-    # Generate the query list using list comprehension.
-    query = [qs for qs in products if qs.percentage >= 20]
+    # the templates show a single discounted product
+    discounts = Product.discounted(products)[:1]
 
     context = {
         'products': paginated_products,
-        'discounts': query,
+        'discounts': price_products(discounts),
         'page_obj': paginated_products,
         'cats': category,
         'active_cat_name': active_cat_name,
@@ -203,14 +218,14 @@ def shop_appliances(request):
         'high': high,
         'low': low,
         'brands': brands,
-        'last_3_products': last_3_products[:3],
-        'top_rate_products': top_rate_products
+        'last_3_products': price_products(last_3_products[:3]),
+        'top_rate_products': price_products(top_rate_products[:3])
     }
     return render(request, 'shop-2.html', context)
 
 
 def shop_books(request):
-    products = Product.objects.filter(is_active=True, product_type='book').order_by('?')
+    products = Product.objects.filter(is_active=True, product_type='book').order_by('shuffle_key', 'id')
     category = Category.objects.filter(is_active=True, product_type='book')
     brands = Brand.objects.filter(product_type='book').order_by('-id')
     authors = Author.objects.all().order_by('name')
@@ -246,32 +261,31 @@ def shop_books(request):
     high = max_value
     low = min_value
 
-    if float(max_value) > 0 or float(min_value) > 0:
-        # range filter
-        products = range_filter(high, low, products)
-
-    if cat or brand or lang or inscription or author_list or len(authors_data) > 0:
-        products = products.filter(
-            Q(category__title=active_cat_name) | Q(brand__title=active_brand_name) |
-            Q(language=lang_name) | Q(yozuv__exact=inscription_name) | Q(author__id__in=authors_data)
-        )
-
-    if inscription_name:
-        products = products.filter(Q(yozuv=inscription_name))
-
-    if wrapper_name:
-        products = products.filter(Q(product_images__wrapper=wrapper_name))
-
-    paginator = Paginator(products, 20)
-    paginated_products = paginator.get_page(page_number)
-
-    # Generate the query list using list comprehension.
-    query = [qs for qs in products if qs.percentage >= 20]
+    # facets: AND between them, OR within one
+    engine = FacetEngine(products, {
+        'category': [category_obj.id for category_obj in category if category_obj.title == cat],
+        'brand': [brand_obj.id for brand_obj in brands if brand_obj.title == brand],
+        'author': authors_data,
+        'language': [lang_name] if lang_name else [],
+        'yozuv': [inscription_name] if inscription_name else [],
+        'wrapper': [wrapper_name] if wrapper_name else [],
+    }, price_min=float(low) or None, price_max=float(high) or None)
+    products = engine.filter()
+    facet_counts = engine.counts(['category', 'brand', 'author', 'language', 'yozuv', 'wrapper'])
+    attach_counts(category, facet_counts['category'])
+    attach_counts(brands, facet_counts['brand'])
+    attach_counts(authors, facet_counts['author'])
+
+    paginator = CachedCountPaginator(products, 20)
+    paginated_products = price_page(paginator.get_page(page_number))
+
+    # the templates show a single discounted product
+    discounts = Product.discounted(products)[:1]
 
     context = {
         'authors': authors,
         'products': paginated_products,
-        'discounts': query,
+        'discounts': price_products(discounts),
         'page_obj': paginated_products,
         'authors_data': authors_data,
         'cats': category,
@@ -284,6 +298,7 @@ def shop_books(request):
         'author_name': author_name,
         'active_page': active_page,
         'brands': brands,
+        'facet_counts': facet_counts,
         'high': high,
         'low': low
 
@@ -292,10 +307,10 @@ def shop_books(request):
 
 
 def shop_clothes(request):
-    products = Product.objects.filter(is_active=True, product_type='clothing').order_by('?')
+    products = Product.objects.filter(is_active=True, product_type='clothing').order_by('shuffle_key', 'id')
     category = Category.objects.filter(is_active=True, product_type='clothing')
     brands = Brand.objects.filter(product_type='clothing').order_by('-id')
-    top_rate_products = sorted(products, key=lambda t: t.mid_rate)
+    top_rate_products = products.order_by('-rate_avg')
     last_3_products = products.order_by('-view')
     colors = Color.objects.all().order_by('title').distinct('title')
     sizes = Size.objects.all()
@@ -321,29 +336,31 @@ def shop_clothes(request):
     low = min_value
     active_page = page_number
 
-    if float(max_value) > 0 or float(min_value) > 0:
-        # range filter
-        products = range_filter(high, low, products)
-
-    if cat or brand or len(colors_ids) > 0 or len(sizes_ids) > 0:
-        products = products.filter(
-            Q(category__title=active_cat_name) | Q(brand__title=active_brand_name) |
-            Q(product_images__color__in=colors_ids) | Q(size__in=sizes_ids)
-        )
-
     if search:
-        products = products.filter(
-            Q(title__icontains=search) | Q(status__contains=search) | Q(brand__title__icontains=search) | Q(
-                description=search))
+        products = search_with_fallback(products, search)
     if advertisement:
         products = products.filter(advertisement__title__contains=advertisement)
 
+    # facets: AND between them, OR within one
+    engine = FacetEngine(products, {
+        'category': [category_obj.id for category_obj in category if category_obj.title == cat],
+        'brand': [brand_obj.id for brand_obj in brands if brand_obj.title == brand],
+        'color': colors_ids,
+        'size': sizes_ids,
+    }, price_min=float(low) or None, price_max=float(high) or None)
+    products = engine.filter()
+    facet_counts = engine.counts(['category', 'brand', 'color', 'size'])
+    attach_counts(category, facet_counts['category'])
+    attach_counts(brands, facet_counts['brand'])
+    attach_counts(colors, facet_counts['color'])
+    attach_counts(sizes, facet_counts['size'])
+
     # paginator
-    paginator = Paginator(products.distinct(), 20)
-    paginated_products = paginator.get_page(page_number)
+    paginator = CachedCountPaginator(products, 20)
+    paginated_products = price_page(paginator.get_page(page_number))
 
-    # Generate the query list using list comprehension.
-    query = [qs for qs in products if qs.percentage >= 20]
+    # the templates show a single discounted product
+    discounts = Product.discounted(products)[:1]
 
     context = {
         'high': high,
@@ -354,73 +371,27 @@ def shop_clothes(request):
         'colors_ids': colors_ids,
         'sizes_ids': sizes_ids,
         'products': paginated_products,
-        'discounts': query,
+        'discounts': price_products(discounts),
         'page_obj': paginated_products,
         'cats': category,
         'active_cat_name': active_cat_name,
         'active_brand_name': active_brand_name,
         'brands': brands,
-        'last_3_products': last_3_products[:3],
-        'top_rate_products': top_rate_products
+        'facet_counts': facet_counts,
+        'last_3_products': price_products(last_3_products[:3]),
+        'top_rate_products': price_products(top_rate_products[:3])
     }
     return render(request, 'shop-clothing.html', context)
 
 
 def shop_details(request, pk):
-    product = get_object_or_404(Product, id=pk)
-    related_products = Product.objects.filter(~Q(id=product.id), category__in=[i.id for i in product.category.all()],
-                                              is_active=True)
-    images = ProductImage.objects.filter(product_id=pk)
-    data = []
-    data_ids = []
-    for image in images:
-        if product.product_type == 'book':
-            if image.wrapper in data_ids:
-                data.append({
-                    "id": image.id,
-                    'wrapper': image.wrapper
-                })
-                number = [d.get('count') for d in data if d['wrapper'] == image.wrapper]
-                data[-1]['count'] = number[0] + 1
-            else:
-                data.append({
-                    "id": image.id,
-                    'count': 1,
-                    'wrapper': image.wrapper
-                })
-                data_ids.append(image.wrapper)
-        else:
-            if image.color_id in data_ids:
-                data.append({
-                    "id": image.id,
-                    'color': image.color_id
-                })
-                number = [d.get('count') for d in data if d['color'] == image.color_id]
-                data[-1]['count'] = number[0] + 1
-            else:
-                data.append({
-                    "id": image.id,
-                    'count': 1,
-                    'color': image.color_id
-                })
-                data_ids.append(image.color_id)
-    filtered_data = sorted(data, key=lambda t: t.get('count'), reverse=True)
-    result_data = []
-    for i in filtered_data:
-        if product.product_type == 'book':
-            res = ProductImage.objects.filter(product_id=pk, wrapper__exact=i['wrapper']).first()
-        else:
-            res = ProductImage.objects.filter(product_id=pk, color_id=i['color']).first()
-        if res not in result_data and res is not None:
-            result_data.append(res)
+    product = get_object_or_404(Product.objects.prefetch_related('installments'), id=pk)
+    gallery = Gallery(product)
     new_products = Product.objects.filter(~Q(id=product.id), is_active=True).order_by('-created_at')[:5]
     comments = Rate.objects.filter(product_id=pk).order_by('-id')
     category = Category.objects.filter(is_active=True)
     colors = Color.objects.all()
-    if product.id:
-        product.view += 1
-        product.save()
-    image_objects = ProductImage.objects.filter(product_id=pk, color=images[0].color)
+    view_counter.add(product.id)
     # comments
     comment = None
     if request.method == "POST":
@@ -434,25 +405,28 @@ def shop_details(request, pk):
             return redirect(f'/shop-details/{product.id}#comments')
     else:
         form = CommentForm()
-    variants = Variant.objects.filter(product_type=product.product_type).order_by('duration')
-    active_variant = variants.filter(product_type=product.product_type).last()
-    total = image_objects.first().price_uzs + ((active_variant.percent * image_objects.first().price_uzs) / 100)
-    _total = product.uzs_price + ((active_variant.percent * product.uzs_price) / 100)
-    monthly = _total / active_variant.duration
+    variants = get_variants(product.product_type)
+    active_variant = variants[-1]
+    installment = product.get_installment(active_variant)
+    if installment is not None:
+        monthly = installment.monthly
+    else:
+        _total = product.uzs_price + ((active_variant.percent * product.uzs_price) / 100)
+        monthly = _total / active_variant.duration
     context = {
         'form': form,
         "colors": colors,
-        "images": result_data,
-        "image_objects": image_objects,
+        "images": gallery.representatives,
+        "image_objects": gallery.default,
         "product": product,
         "variants": variants,
         "active_variant": active_variant,
         "default_monthly_price": int(monthly),
         "monthly": int(monthly),
         'comments': comments,
-        "new_products": new_products,
+        "new_products": price_products(new_products),
         "categories": category,
-        "related_products": related_products[:4],
+        "related_products": price_products(related_products(product)),
     }
     return render(request, "shop-details.html", context)
 
@@ -473,58 +447,35 @@ def shop_images(request):
 
 
 class PorductDetail(RetrieveAPIView):
-    queryset = Product.objects.all()
     serializer_class = ProductRetrieveSerializer
 
+    def get_queryset(self):
+        return Product.objects.select_related('brand', 'author') \
+            .prefetch_related('category', 'size', 'additional_info', Prefetch(
+                'product_images', queryset=ProductImage.objects.select_related('color').order_by('id')))
+
     def retrieve(self, request, *args, **kwargs):
         product = self.get_object()
-        qs = self.queryset.filter(~Q(id=product.id), is_active=True)
+        qs = Product.objects.filter(~Q(id=product.id), is_active=True)
         data = ProductRetrieveSerializer(product, many=False).data
-        footer = AppProductSerializer(qs.filter(category__in=[i.id for i in product.category.all()], ), many=True).data
+        related = related_products(product, RELATED_LIMIT).prefetch_related(
+            'category', Prefetch('product_images', queryset=ProductImage.objects.select_related('color')))
+        footer = AppProductSerializer(related, many=True).data
         sidebar = AppProductSerializer(qs.order_by('-created_at')[:5], many=True).data
-        variant = VariantSerializer(Variant.objects.filter(product_type=product.product_type), many=True).data
+        variant = VariantSerializer(get_variants(product.product_type), many=True).data
 
         return Response({'data': data, 'footer': footer, 'sidebar': sidebar, 'variant': variant})
 
 
 def book_detail(request, pk):
-    product = get_object_or_404(Product, id=pk)
-    related_products = Product.objects.filter(~Q(id=product.id), category__in=[i.id for i in product.category.all()],
-                                              is_active=True)
-    images = ProductImage.objects.filter(product_id=pk)
-    data = []
-    data_ids = []
-    for image in images:
-        if image.wrapper in data_ids:
-            data.append({
-                "id": image.id,
-                'wrapper': image.wrapper
-            })
-            number = [d.get('count') for d in data if d['wrapper'] == image.wrapper]
-            data[-1]['count'] = number[0] + 1
-        else:
-            data.append({
-                "id": image.id,
-                'count': 1,
-                'wrapper': image.wrapper
-            })
-            data_ids.append(image.wrapper)
-
-    filtered_data = sorted(data, key=lambda t: t.get('count'), reverse=True)
-    result_data = []
-    for i in filtered_data:
-        res = ProductImage.objects.filter(product_id=pk, wrapper__exact=i['wrapper']).first()
-        if res not in result_data and res is not None:
-            result_data.append(res)
+    product = get_object_or_404(Product.objects.prefetch_related('installments'), id=pk)
+    gallery = Gallery(product)
 
     new_products = Product.objects.filter(~Q(id=product.id), is_active=True).order_by('-created_at')[:5]
     comments = Rate.objects.filter(product_id=pk).order_by('-id')
     category = Category.objects.filter(is_active=True)
     colors = Color.objects.all()
-    if product.id:
-        product.view += 1
-        product.save()
-    image_objects = ProductImage.objects.filter(product_id=pk, color=images[0].color)
+    view_counter.add(product.id)
     # comments
     comment = None
     if request.method == "POST":
@@ -538,22 +489,26 @@ def book_detail(request, pk):
             return redirect(f'/shop-details/{product.id}#comments')
     else:
         form = CommentForm()
-    variants = Variant.objects.filter(product_type=product.product_type).order_by('duration')
-    active_variant = variants.filter(product_type=product.product_type).last()
-    _total = product.uzs_price + ((active_variant.percent * product.uzs_price) / 100)
-    monthly = _total / active_variant.duration
+    variants = get_variants(product.product_type)
+    active_variant = variants[-1]
+    installment = product.get_installment(active_variant)
+    if installment is not None:
+        monthly = installment.monthly
+    else:
+        _total = product.uzs_price + ((active_variant.percent * product.uzs_price) / 100)
+        monthly = _total / active_variant.duration
     context = {
         'form': form,
         "colors": colors,
-        "images": result_data,
-        "image_objects": image_objects,
+        "images": gallery.representatives,
+        "image_objects": gallery.default,
         "product": product,
         "variants": variants,
         "active_variant": active_variant,
         "default_monthly_price": int(monthly),
         'comments': comments,
-        "new_products": new_products,
+        "new_products": price_products(new_products),
         "categories": category,
-        "related_products": related_products[:4],
+        "related_products": price_products(related_products(product)),
     }
     return render(request, "book-detail.html", context)